@@ -1,9 +1,15 @@
+import re
 import sqlite3
+import threading
+import time
+from collections import defaultdict
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
-from typing import Iterable, Optional
+from typing import Iterable, Iterator, Optional
 
 DB_PATH = "bot.sqlite3"
+SCHEMA_VERSION = 9
 
 
 def get_tashkent_tz() -> timezone:
@@ -20,14 +26,90 @@ def now_tashkent() -> datetime:
     return datetime.now(TASHKENT_TZ)
 
 
-def get_connection() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+NON_DIGIT_RE = re.compile(r"\D+")
+
+
+@lru_cache(maxsize=4096)
+def normalize_phone(value: str) -> str:
+    digits = NON_DIGIT_RE.sub("", value)
+    if digits.startswith("998") and len(digits) >= 12:
+        return digits[-9:]
+    return digits
+
+
+def to_epoch(value: str) -> int:
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+
+SESSION_PRAGMAS = """
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA mmap_size=268435456;
+    PRAGMA cache_size=-65536;
+    PRAGMA busy_timeout=5000;
+    PRAGMA foreign_keys=ON;
+"""
+
+UPSERT_USER_SQL = """
+    INSERT INTO users (tg_id, first_name, last_name, created_at, last_active, created_at_ts, last_active_ts)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(tg_id) DO UPDATE SET
+        first_name = excluded.first_name,
+        last_name = excluded.last_name,
+        last_active = excluded.last_active,
+        last_active_ts = excluded.last_active_ts
+"""
+ORDER_DETAILS_SQL = """
+    SELECT
+        orders.id,
+        orders.quantity,
+        orders.address,
+        orders.latitude,
+        orders.longitude,
+        orders.created_at,
+        orders.status,
+        orders.order_price_per_kg,
+        orders.canceled_by_role,
+        users.first_name,
+        users.last_name,
+        users.phone,
+        products.name AS product_name,
+        products.price_per_kg AS product_price_per_kg{extra}
+    FROM orders
+    JOIN users ON orders.user_id = users.id
+    JOIN products ON orders.product_id = products.id
+"""
+GET_USER_BY_TG_ID_SQL = "SELECT * FROM users WHERE tg_id = ?"
+IS_USER_BLOCKED_SQL = "SELECT is_blocked FROM users WHERE tg_id = ?"
+
+_initialized = False
+_local = threading.local()
+
+
+def open_connection() -> sqlite3.Connection:
+    global _initialized
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256)
     conn.row_factory = sqlite3.Row
+    if not _initialized:
+        conn.execute("PRAGMA journal_mode=WAL")
+        _initialized = True
+    conn.executescript(SESSION_PRAGMAS)
+    return conn
+
+
+def get_connection() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = open_connection()
     return conn
 
 
 def init_db() -> None:
     with get_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
         conn.execute(
             """
             CREATE TABLE IF NOT EXISTS users (
@@ -39,7 +121,11 @@ def init_db() -> None:
                 created_at TEXT NOT NULL,
                 last_active TEXT NOT NULL,
                 activity_count INTEGER NOT NULL DEFAULT 0,
-                is_blocked INTEGER NOT NULL DEFAULT 0
+                is_blocked INTEGER NOT NULL DEFAULT 0,
+                closed_order_count INTEGER NOT NULL DEFAULT 0,
+                created_at_ts INTEGER,
+                last_active_ts INTEGER,
+                normalized_phone TEXT
             )
             """
         )
@@ -79,133 +165,288 @@ def init_db() -> None:
                 status TEXT NOT NULL DEFAULT 'open',
                 order_price_per_kg REAL,
                 closed_at TEXT,
+                created_at_ts INTEGER,
+                closed_at_ts INTEGER,
                 FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
                 FOREIGN KEY(product_id) REFERENCES products(id) ON DELETE CASCADE
             )
             """
         )
-        try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            for statement in (
+                "ALTER TABLE orders ADD COLUMN status TEXT NOT NULL DEFAULT 'open'",
+                "ALTER TABLE orders ADD COLUMN order_price_per_kg REAL",
+                "ALTER TABLE orders ADD COLUMN closed_at TEXT",
+                "ALTER TABLE orders ADD COLUMN closed_by INTEGER",
+                "ALTER TABLE orders ADD COLUMN canceled_by_role TEXT",
+                "ALTER TABLE orders ADD COLUMN latitude REAL",
+                "ALTER TABLE orders ADD COLUMN longitude REAL",
+                "ALTER TABLE users ADD COLUMN activity_count INTEGER NOT NULL DEFAULT 0",
+                "ALTER TABLE users ADD COLUMN is_blocked INTEGER NOT NULL DEFAULT 0",
+                "ALTER TABLE products ADD COLUMN is_deleted INTEGER NOT NULL DEFAULT 0",
+            ):
+                try:
+                    conn.execute(statement)
+                except sqlite3.OperationalError:
+                    pass
+            conn.execute("UPDATE orders SET status = 'open' WHERE status IS NULL")
             conn.execute(
-                "ALTER TABLE orders ADD COLUMN status TEXT NOT NULL DEFAULT 'open'"
+                """
+                UPDATE orders
+                SET order_price_per_kg = products.price_per_kg
+                FROM products
+                WHERE products.id = orders.product_id
+                  AND orders.order_price_per_kg IS NULL
+                """
             )
-        except sqlite3.OperationalError:
-            pass
-        try:
-            conn.execute("ALTER TABLE orders ADD COLUMN order_price_per_kg REAL")
-        except sqlite3.OperationalError:
-            pass
-        try:
-            conn.execute("ALTER TABLE orders ADD COLUMN closed_at TEXT")
-        except sqlite3.OperationalError:
-            pass
-        try:
-            conn.execute("ALTER TABLE orders ADD COLUMN closed_by INTEGER")
-        except sqlite3.OperationalError:
-            pass
-        try:
-            conn.execute("ALTER TABLE orders ADD COLUMN canceled_by_role TEXT")
-        except sqlite3.OperationalError:
-            pass
-        try:
-            conn.execute("ALTER TABLE orders ADD COLUMN latitude REAL")
-        except sqlite3.OperationalError:
-            pass
-        try:
-            conn.execute("ALTER TABLE orders ADD COLUMN longitude REAL")
-        except sqlite3.OperationalError:
-            pass
-        try:
             conn.execute(
-                "ALTER TABLE users ADD COLUMN activity_count INTEGER NOT NULL DEFAULT 0"
+                """
+                UPDATE orders
+                SET canceled_by_role = CASE
+                    WHEN closed_by IS NULL THEN 'user'
+                    ELSE 'admin'
+                END
+                WHERE status = 'canceled' AND canceled_by_role IS NULL
+                """
             )
-        except sqlite3.OperationalError:
-            pass
-        try:
+        if version < 2:
+            for statement in (
+                "CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders(status, created_at DESC)",
+                "CREATE INDEX IF NOT EXISTS idx_orders_user ON orders(user_id, created_at DESC)",
+                "CREATE INDEX IF NOT EXISTS idx_orders_product ON orders(product_id)",
+                "CREATE INDEX IF NOT EXISTS idx_product_photos_pid ON product_photos(product_id, position)",
+            ):
+                conn.execute(statement)
+        if version < 3:
             conn.execute(
-                "ALTER TABLE users ADD COLUMN is_blocked INTEGER NOT NULL DEFAULT 0"
+                "CREATE TABLE IF NOT EXISTS stats (key TEXT PRIMARY KEY, value INTEGER NOT NULL)"
             )
-        except sqlite3.OperationalError:
-            pass
-        try:
             conn.execute(
-                "ALTER TABLE products ADD COLUMN is_deleted INTEGER NOT NULL DEFAULT 0"
+                """
+                INSERT OR REPLACE INTO stats (key, value)
+                VALUES
+                    ('orders_total', (SELECT COUNT(*) FROM orders)),
+                    ('users_total', (SELECT COUNT(*) FROM users))
+                """
             )
-        except sqlite3.OperationalError:
-            pass
-        conn.execute("UPDATE orders SET status = 'open' WHERE status IS NULL")
-        conn.execute(
-            """
-            UPDATE orders
-            SET order_price_per_kg = (
-                SELECT price_per_kg FROM products WHERE products.id = orders.product_id
+            for table, key in (("orders", "orders_total"), ("users", "users_total")):
+                conn.execute(
+                    f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_{table}_ins AFTER INSERT ON {table}
+                    BEGIN
+                        UPDATE stats SET value = value + 1 WHERE key = '{key}';
+                    END
+                    """
+                )
+                conn.execute(
+                    f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_{table}_del AFTER DELETE ON {table}
+                    BEGIN
+                        UPDATE stats SET value = value - 1 WHERE key = '{key}';
+                    END
+                    """
+                )
+        if version < 4:
+            try:
+                conn.execute(
+                    "ALTER TABLE users ADD COLUMN closed_order_count INTEGER NOT NULL DEFAULT 0"
+                )
+            except sqlite3.OperationalError:
+                pass
+            conn.execute(
+                """
+                UPDATE users
+                SET closed_order_count = (
+                    SELECT COUNT(*) FROM orders
+                    WHERE orders.user_id = users.id AND orders.status = 'closed'
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_users_closed_orders
+                ON users(closed_order_count DESC, id DESC)
+                """
+            )
+            conn.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS trg_orders_closed_ins
+                AFTER INSERT ON orders WHEN NEW.status = 'closed'
+                BEGIN
+                    UPDATE users SET closed_order_count = closed_order_count + 1
+                    WHERE id = NEW.user_id;
+                END
+                """
+            )
+            conn.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS trg_orders_closed_open
+                AFTER UPDATE OF status ON orders
+                WHEN OLD.status <> 'closed' AND NEW.status = 'closed'
+                BEGIN
+                    UPDATE users SET closed_order_count = closed_order_count + 1
+                    WHERE id = NEW.user_id;
+                END
+                """
+            )
+            conn.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS trg_orders_closed_reopen
+                AFTER UPDATE OF status ON orders
+                WHEN OLD.status = 'closed' AND NEW.status <> 'closed'
+                BEGIN
+                    UPDATE users SET closed_order_count = closed_order_count - 1
+                    WHERE id = OLD.user_id;
+                END
+                """
             )
-            WHERE order_price_per_kg IS NULL
-            """
-        )
-        conn.execute(
-            """
-            UPDATE orders
-            SET canceled_by_role = CASE
-                WHEN closed_by IS NULL THEN 'user'
-                ELSE 'admin'
-            END
-            WHERE status = 'canceled' AND canceled_by_role IS NULL
-            """
-        )
-
-
-def add_or_update_user(tg_id: int, first_name: str, last_name: Optional[str]) -> None:
-    now = now_tashkent().isoformat()
-    with get_connection() as conn:
-        existing = conn.execute(
-            "SELECT id FROM users WHERE tg_id = ?", (tg_id,)
-        ).fetchone()
-        if existing:
+            conn.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS trg_orders_closed_del
+                AFTER DELETE ON orders WHEN OLD.status = 'closed'
+                BEGIN
+                    UPDATE users SET closed_order_count = closed_order_count - 1
+                    WHERE id = OLD.user_id;
+                END
+                """
+            )
+        if version < 5:
+            conn.execute(
+                """
+                UPDATE orders
+                SET closed_at = created_at
+                WHERE status = 'closed' AND closed_at IS NULL
+                """
+            )
+        if version < 6:
+            for statement in (
+                "ALTER TABLE users ADD COLUMN created_at_ts INTEGER",
+                "ALTER TABLE users ADD COLUMN last_active_ts INTEGER",
+                "ALTER TABLE orders ADD COLUMN created_at_ts INTEGER",
+                "ALTER TABLE orders ADD COLUMN closed_at_ts INTEGER",
+            ):
+                try:
+                    conn.execute(statement)
+                except sqlite3.OperationalError:
+                    pass
             conn.execute(
                 """
                 UPDATE users
-                SET first_name = ?, last_name = ?, last_active = ?
-                WHERE tg_id = ?
-                """,
-                (first_name, last_name, now, tg_id),
+                SET created_at_ts = CAST(strftime('%s', created_at) AS INTEGER),
+                    last_active_ts = CAST(strftime('%s', last_active) AS INTEGER)
+                """
             )
-        else:
             conn.execute(
                 """
-                INSERT INTO users (tg_id, first_name, last_name, created_at, last_active)
-                VALUES (?, ?, ?, ?, ?)
-                """,
-                (tg_id, first_name, last_name, now, now),
+                UPDATE orders
+                SET created_at_ts = CAST(strftime('%s', created_at) AS INTEGER),
+                    closed_at_ts = CAST(strftime('%s', closed_at) AS INTEGER)
+                """
+            )
+            for statement in (
+                "CREATE INDEX IF NOT EXISTS idx_orders_status_closedts ON orders(status, closed_at_ts)",
+                "CREATE INDEX IF NOT EXISTS idx_users_last_active_ts ON users(last_active_ts)",
+            ):
+                conn.execute(statement)
+        if version < 7:
+            conn.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS trg_product_softdel
+                AFTER UPDATE OF is_deleted ON products
+                WHEN NEW.is_deleted = 1 AND OLD.is_deleted = 0
+                BEGIN
+                    DELETE FROM product_photos WHERE product_id = NEW.id;
+                END
+                """
+            )
+            conn.execute(
+                """
+                DELETE FROM product_photos
+                WHERE product_id IN (SELECT id FROM products WHERE is_deleted = 1)
+                """
+            )
+        if version < 8:
+            try:
+                conn.execute("ALTER TABLE users ADD COLUMN normalized_phone TEXT")
+            except sqlite3.OperationalError:
+                pass
+            conn.executemany(
+                "UPDATE users SET normalized_phone = ? WHERE id = ?",
+                [
+                    (normalize_phone(row["phone"]), row["id"])
+                    for row in conn.execute("SELECT id, phone FROM users WHERE phone IS NOT NULL")
+                ],
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_users_norm_phone ON users(normalized_phone)"
+            )
+        if version < 9:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS support_replies (
+                    group_id INTEGER NOT NULL,
+                    message_id INTEGER NOT NULL,
+                    tg_id INTEGER NOT NULL,
+                    created_at_ts INTEGER NOT NULL,
+                    PRIMARY KEY (group_id, message_id)
+                ) WITHOUT ROWID
+                """
             )
+        if version < SCHEMA_VERSION:
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    optimize()
 
 
-def update_user_phone(tg_id: int, phone: str) -> None:
+def optimize() -> None:
+    get_connection().execute("PRAGMA optimize")
+
+
+def add_or_update_user(
+    tg_id: int,
+    first_name: str,
+    last_name: Optional[str],
+    now: Optional[str] = None,
+) -> None:
+    if now is None:
+        now = now_tashkent().isoformat()
+    ts = to_epoch(now)
     with get_connection() as conn:
-        conn.execute(
-            "UPDATE users SET phone = ? WHERE tg_id = ?",
-            (phone, tg_id),
-        )
+        conn.execute(UPSERT_USER_SQL, (tg_id, first_name, last_name, now, now, ts, ts))
 
 
-def update_last_active(tg_id: int) -> None:
-    now = now_tashkent().isoformat()
+def update_last_active_many(entries: Iterable[tuple[int, str, int]]) -> None:
     with get_connection() as conn:
-        conn.execute(
+        conn.executemany(
             """
             UPDATE users
             SET last_active = ?,
-                activity_count = COALESCE(activity_count, 0) + 1
+                last_active_ts = ?,
+                activity_count = COALESCE(activity_count, 0) + ?
             WHERE tg_id = ?
             """,
-            (now, tg_id),
+            [(now, to_epoch(now), count, tg_id) for tg_id, now, count in entries],
         )
 
 
+def update_user_phone(tg_id: int, phone: str) -> None:
+    with get_connection() as conn:
+        conn.execute(
+            "UPDATE users SET phone = ?, normalized_phone = ? WHERE tg_id = ?",
+            (phone, normalize_phone(phone), tg_id),
+        )
+
+
+def find_user_by_normalized_phone(normalized_phone: str) -> Optional[sqlite3.Row]:
+    return get_connection().execute(
+        "SELECT * FROM users WHERE normalized_phone = ? ORDER BY id LIMIT 1",
+        (normalized_phone,),
+    ).fetchone()
+
+
 def get_user_by_tg_id(tg_id: int) -> Optional[sqlite3.Row]:
     with get_connection() as conn:
-        return conn.execute(
-            "SELECT * FROM users WHERE tg_id = ?", (tg_id,)
-        ).fetchone()
+        return conn.execute(GET_USER_BY_TG_ID_SQL, (tg_id,)).fetchone()
 
 
 def set_user_blocked(tg_id: int, blocked: bool) -> None:
@@ -218,16 +459,16 @@ def set_user_blocked(tg_id: int, blocked: bool) -> None:
 
 def is_user_blocked(tg_id: int) -> bool:
     with get_connection() as conn:
-        row = conn.execute(
-            "SELECT is_blocked FROM users WHERE tg_id = ?",
-            (tg_id,),
-        ).fetchone()
+        row = conn.execute(IS_USER_BLOCKED_SQL, (tg_id,)).fetchone()
     return bool(row and row["is_blocked"])
 
 
-def list_users() -> Iterable[sqlite3.Row]:
+def list_user_ids_after(after_id: int, limit: int) -> list[sqlite3.Row]:
     with get_connection() as conn:
-        return conn.execute("SELECT * FROM users").fetchall()
+        return conn.execute(
+            "SELECT id, tg_id FROM users WHERE id > ? ORDER BY id LIMIT ?",
+            (after_id, limit),
+        ).fetchall()
 
 
 def add_product(name: str, price_per_kg: float, description: Optional[str]) -> int:
@@ -276,16 +517,40 @@ def update_product_description(product_id: int, description: str) -> None:
 
 
 def set_product_photos(product_id: int, file_ids: list[str]) -> None:
+    wanted = dict(enumerate(file_ids))
     with get_connection() as conn:
-        conn.execute("DELETE FROM product_photos WHERE product_id = ?", (product_id,))
-        for position, file_id in enumerate(file_ids):
-            conn.execute(
-                """
-                INSERT INTO product_photos (product_id, file_id, position)
-                VALUES (?, ?, ?)
-                """,
-                (product_id, file_id, position),
+        existing = {
+            row["position"]: row["file_id"]
+            for row in conn.execute(
+                "SELECT position, file_id FROM product_photos WHERE product_id = ?",
+                (product_id,),
             )
+        }
+        if existing == wanted:
+            return
+        conn.executemany(
+            "DELETE FROM product_photos WHERE product_id = ? AND position = ?",
+            [(product_id, position) for position in existing if position not in wanted],
+        )
+        conn.executemany(
+            "UPDATE product_photos SET file_id = ? WHERE product_id = ? AND position = ?",
+            [
+                (file_id, product_id, position)
+                for position, file_id in wanted.items()
+                if position in existing and existing[position] != file_id
+            ],
+        )
+        conn.executemany(
+            """
+            INSERT INTO product_photos (product_id, file_id, position)
+            VALUES (?, ?, ?)
+            """,
+            [
+                (product_id, file_id, position)
+                for position, file_id in wanted.items()
+                if position not in existing
+            ],
+        )
 
 
 def list_products() -> Iterable[sqlite3.Row]:
@@ -305,7 +570,6 @@ def get_product(product_id: int) -> Optional[sqlite3.Row]:
 
 def delete_product(product_id: int) -> bool:
     with get_connection() as conn:
-        conn.execute("DELETE FROM product_photos WHERE product_id = ?", (product_id,))
         cur = conn.execute(
             "UPDATE products SET is_deleted = 1 WHERE id = ? AND is_deleted = 0",
             (product_id,),
@@ -322,6 +586,25 @@ def get_product_photos(product_id: int) -> list[str]:
     return [row["file_id"] for row in rows]
 
 
+def get_product_photos_many(product_ids: list[int]) -> dict[int, list[str]]:
+    photos: dict[int, list[str]] = defaultdict(list)
+    if not product_ids:
+        return photos
+    placeholders = ",".join("?" * len(product_ids))
+    rows = get_connection().execute(
+        f"""
+        SELECT product_id, file_id
+        FROM product_photos
+        WHERE product_id IN ({placeholders})
+        ORDER BY product_id, position
+        """,
+        product_ids,
+    )
+    for row in rows:
+        photos[row["product_id"]].append(row["file_id"])
+    return photos
+
+
 def add_order(
     user_id: int,
     product_id: int,
@@ -330,8 +613,10 @@ def add_order(
     order_price_per_kg: float,
     latitude: Optional[float] = None,
     longitude: Optional[float] = None,
+    now: Optional[str] = None,
 ) -> int:
-    now = now_tashkent().isoformat()
+    if now is None:
+        now = now_tashkent().isoformat()
     with get_connection() as conn:
         cur = conn.execute(
             """
@@ -343,10 +628,11 @@ def add_order(
                 latitude,
                 longitude,
                 created_at,
+                created_at_ts,
                 status,
                 order_price_per_kg
             )
-            VALUES (?, ?, ?, ?, ?, ?, ?, 'open', ?)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'open', ?)
             """,
             (
                 user_id,
@@ -356,29 +642,34 @@ def add_order(
                 latitude,
                 longitude,
                 now,
+                to_epoch(now),
                 order_price_per_kg,
             ),
         )
         return int(cur.lastrowid)
 
 
-def add_manual_user(name: str, phone: str, admin_id: int) -> int:
-    now = now_tashkent().isoformat()
-    base_id = -int(now_tashkent().timestamp() * 1000) * 1000 - admin_id
-    for offset in range(5):
-        tg_id = base_id - offset
-        try:
-            with get_connection() as conn:
-                cur = conn.execute(
-                    """
-                    INSERT INTO users (tg_id, first_name, last_name, phone, created_at, last_active)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                    """,
-                    (tg_id, name, None, phone, now, now),
+def add_manual_user(name: str, phone: str, admin_id: int, now: Optional[str] = None) -> int:
+    if now is None:
+        now = now_tashkent().isoformat()
+    base_id = -int(datetime.fromisoformat(now).timestamp() * 1000) * 1000 - admin_id
+    ts = to_epoch(now)
+    with get_connection() as conn:
+        for offset in range(5):
+            row = conn.execute(
+                """
+                INSERT INTO users (
+                    tg_id, first_name, last_name, phone, normalized_phone,
+                    created_at, last_active, created_at_ts, last_active_ts
                 )
-            return int(cur.lastrowid)
-        except sqlite3.IntegrityError:
-            continue
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(tg_id) DO NOTHING
+                RETURNING id
+                """,
+                (base_id - offset, name, None, phone, normalize_phone(phone), now, now, ts, ts),
+            ).fetchone()
+            if row:
+                return int(row["id"])
     raise RuntimeError("Failed to create a manual user record.")
 
 
@@ -389,8 +680,11 @@ def add_admin_order(
     address: str,
     order_price_per_kg: float,
     admin_id: int,
+    now: Optional[str] = None,
 ) -> int:
-    now = now_tashkent().isoformat()
+    if now is None:
+        now = now_tashkent().isoformat()
+    ts = to_epoch(now)
     with get_connection() as conn:
         cur = conn.execute(
             """
@@ -400,12 +694,14 @@ def add_admin_order(
                 quantity,
                 address,
                 created_at,
+                created_at_ts,
                 status,
                 order_price_per_kg,
                 closed_at,
+                closed_at_ts,
                 closed_by
             )
-            VALUES (?, ?, ?, ?, ?, 'closed', ?, ?, ?)
+            VALUES (?, ?, ?, ?, ?, ?, 'closed', ?, ?, ?, ?)
             """,
             (
                 user_id,
@@ -413,8 +709,10 @@ def add_admin_order(
                 quantity,
                 address,
                 now,
+                ts,
                 order_price_per_kg,
                 now,
+                ts,
                 admin_id,
             ),
         )
@@ -425,67 +723,115 @@ def update_order_status(
     order_id: int,
     new_status: str,
     admin_id: int,
+    now: Optional[str] = None,
 ) -> tuple[bool, Optional[str], Optional[int], Optional[str]]:
-    now = now_tashkent().isoformat()
+    if now is None:
+        now = now_tashkent().isoformat()
+    canceled_by_role = "admin" if new_status == "canceled" else None
     with get_connection() as conn:
+        row = conn.execute(
+            """
+            UPDATE orders
+            SET status = ?, closed_at = ?, closed_at_ts = ?, closed_by = ?, canceled_by_role = ?
+            WHERE id = ? AND status = 'open'
+            RETURNING status, closed_by, canceled_by_role
+            """,
+            (new_status, now, to_epoch(now), admin_id, canceled_by_role, order_id),
+        ).fetchone()
+        if row:
+            return True, row["status"], row["closed_by"], row["canceled_by_role"]
         row = conn.execute(
             "SELECT status, closed_by, canceled_by_role FROM orders WHERE id = ?",
             (order_id,),
         ).fetchone()
         if not row:
             return False, None, None, None
-        current_status = row["status"]
-        if current_status != "open":
-            return False, current_status, row["closed_by"], row["canceled_by_role"]
-        canceled_by_role = "admin" if new_status == "canceled" else None
-        conn.execute(
-            """
-            UPDATE orders
-            SET status = ?, closed_at = ?, closed_by = ?, canceled_by_role = ?
-            WHERE id = ? AND status = 'open'
-            """,
-            (new_status, now, admin_id, canceled_by_role, order_id),
-        )
-        return True, new_status, admin_id, canceled_by_role
+        return False, row["status"], row["closed_by"], row["canceled_by_role"]
 
 
-def cancel_order_by_user(
+def cancel_order_by_tg_id(
     order_id: int,
-    user_id: int,
+    tg_id: int,
+    now: Optional[str] = None,
 ) -> tuple[bool, Optional[str], Optional[str]]:
-    now = datetime.utcnow().isoformat()
+    if now is None:
+        now = now_tashkent().isoformat()
     with get_connection() as conn:
         row = conn.execute(
             """
-            SELECT status, canceled_by_role
+            UPDATE orders
+            SET status = 'canceled',
+                closed_at = ?,
+                closed_at_ts = ?,
+                closed_by = NULL,
+                canceled_by_role = 'user'
+            WHERE id = ?
+              AND user_id = (SELECT id FROM users WHERE tg_id = ?)
+              AND status = 'open'
+            RETURNING status, canceled_by_role
+            """,
+            (now, to_epoch(now), order_id, tg_id),
+        ).fetchone()
+        if row:
+            return True, row["status"], row["canceled_by_role"]
+        row = conn.execute(
+            """
+            SELECT orders.status, orders.canceled_by_role
             FROM orders
-            WHERE id = ? AND user_id = ?
+            JOIN users ON orders.user_id = users.id
+            WHERE orders.id = ? AND users.tg_id = ?
             """,
-            (order_id, user_id),
+            (order_id, tg_id),
         ).fetchone()
         if not row:
             return False, None, None
-        current_status = row["status"]
-        if current_status != "open":
-            return False, current_status, row["canceled_by_role"]
-        conn.execute(
+        return False, row["status"], row["canceled_by_role"]
+
+
+def add_support_replies(entries: Iterable[tuple[int, int, int]]) -> None:
+    created_at_ts = int(time.time())
+    with get_connection() as conn:
+        conn.executemany(
             """
-            UPDATE orders
-            SET status = 'canceled',
-                closed_at = ?,
-                closed_by = NULL,
-                canceled_by_role = 'user'
-            WHERE id = ? AND user_id = ? AND status = 'open'
+            INSERT OR REPLACE INTO support_replies (group_id, message_id, tg_id, created_at_ts)
+            VALUES (?, ?, ?, ?)
             """,
-            (now, order_id, user_id),
+            [(group_id, message_id, tg_id, created_at_ts) for group_id, message_id, tg_id in entries],
         )
-        return True, "canceled", "user"
 
 
-def count_orders() -> int:
+def get_support_reply_user(group_id: int, message_id: int) -> Optional[int]:
     with get_connection() as conn:
-        row = conn.execute("SELECT COUNT(*) AS total FROM orders").fetchone()
-    return int(row["total"])
+        row = conn.execute(
+            "SELECT tg_id FROM support_replies WHERE group_id = ? AND message_id = ?",
+            (group_id, message_id),
+        ).fetchone()
+    return row["tg_id"] if row else None
+
+
+def prune_support_replies(days: int) -> None:
+    cutoff = int(time.time()) - days * 86400
+    with get_connection() as conn:
+        conn.execute("DELETE FROM support_replies WHERE created_at_ts < ?", (cutoff,))
+
+
+def get_stat(key: str) -> int:
+    with get_connection() as conn:
+        row = conn.execute("SELECT value FROM stats WHERE key = ?", (key,)).fetchone()
+    return int(row["value"]) if row else 0
+
+
+def count_orders() -> int:
+    return get_stat("orders_total")
+
+
+def get_order_stats() -> tuple[int, int, int, int]:
+    return (
+        count_orders(),
+        count_orders_by_status("open"),
+        count_orders_by_status("closed"),
+        count_orders_by_status("canceled"),
+    )
 
 
 def count_orders_by_status(status: str) -> int:
@@ -502,26 +848,7 @@ def list_orders_with_details(
     limit: Optional[int] = None,
     offset: int = 0,
 ) -> Iterable[sqlite3.Row]:
-    query = """
-        SELECT
-            orders.id,
-            orders.quantity,
-            orders.address,
-            orders.latitude,
-            orders.longitude,
-            orders.created_at,
-            orders.status,
-            orders.order_price_per_kg,
-            orders.canceled_by_role,
-            users.first_name,
-            users.last_name,
-            users.phone,
-            products.name AS product_name,
-            products.price_per_kg AS product_price_per_kg
-        FROM orders
-        JOIN users ON orders.user_id = users.id
-        JOIN products ON orders.product_id = products.id
-    """
+    query = ORDER_DETAILS_SQL.format(extra="")
     params: list[object] = []
     if status:
         query += " WHERE orders.status = ?"
@@ -534,10 +861,28 @@ def list_orders_with_details(
         return conn.execute(query, params).fetchall()
 
 
+def list_orders_with_details_and_total(
+    status: str,
+    limit: int,
+    offset: int = 0,
+    total: Optional[int] = None,
+) -> tuple[list[sqlite3.Row], int]:
+    if total is not None:
+        return list_orders_with_details(status, limit, offset), total
+    query = (
+        ORDER_DETAILS_SQL.format(extra=", COUNT(*) OVER () AS total")
+        + " WHERE orders.status = ? ORDER BY orders.created_at DESC LIMIT ? OFFSET ?"
+    )
+    with get_connection() as conn:
+        rows = conn.execute(query, (status, limit, offset)).fetchall()
+    total = int(rows[0]["total"]) if rows else 0
+    return rows, total
+
+
 def list_orders_for_report(
     start_at: str,
     end_at: str,
-) -> Iterable[sqlite3.Row]:
+) -> Iterator[sqlite3.Row]:
     query = """
         SELECT
             orders.id,
@@ -554,12 +899,15 @@ def list_orders_for_report(
         JOIN users ON orders.user_id = users.id
         JOIN products ON orders.product_id = products.id
         WHERE orders.status = 'closed'
-          AND date(COALESCE(orders.closed_at, orders.created_at)) >= date(?)
-          AND date(COALESCE(orders.closed_at, orders.created_at)) <= date(?)
-        ORDER BY orders.created_at ASC
+          AND orders.closed_at_ts >= ?
+          AND orders.closed_at_ts < ?
+        ORDER BY orders.created_at_ts ASC
     """
-    with get_connection() as conn:
-        return conn.execute(query, (start_at, end_at)).fetchall()
+    start = datetime.strptime(start_at, "%Y-%m-%d").replace(tzinfo=TASHKENT_TZ)
+    end_before = datetime.strptime(end_at, "%Y-%m-%d").replace(tzinfo=TASHKENT_TZ) + timedelta(days=1)
+    yield from get_connection().execute(
+        query, (int(start.timestamp()), int(end_before.timestamp()))
+    )
 
 
 def get_order_with_details(order_id: int) -> Optional[sqlite3.Row]:
@@ -595,7 +943,7 @@ def delete_order(order_id: int) -> bool:
         return cur.rowcount > 0
 
 
-def list_orders_for_user(user_id: int) -> Iterable[sqlite3.Row]:
+def list_orders_for_tg_id(tg_id: int) -> Iterable[sqlite3.Row]:
     query = """
         SELECT
             orders.id,
@@ -611,41 +959,48 @@ def list_orders_for_user(user_id: int) -> Iterable[sqlite3.Row]:
             products.price_per_kg AS product_price_per_kg
         FROM orders
         JOIN products ON orders.product_id = products.id
-        WHERE orders.user_id = ?
+        WHERE orders.user_id = (SELECT id FROM users WHERE tg_id = ?)
         ORDER BY orders.created_at DESC
     """
     with get_connection() as conn:
-        return conn.execute(query, (user_id,)).fetchall()
+        return conn.execute(query, (tg_id,)).fetchall()
 
 
 def count_users() -> int:
-    with get_connection() as conn:
-        row = conn.execute("SELECT COUNT(*) AS total FROM users").fetchone()
-    return int(row["total"])
+    return get_stat("users_total")
 
 
 def count_active_users(days: int) -> int:
-    cutoff = (datetime.utcnow() - timedelta(days=days)).isoformat()
+    cutoff = int(time.time()) - days * 86400
     with get_connection() as conn:
         row = conn.execute(
-            "SELECT COUNT(*) AS total FROM users WHERE last_active >= ?",
+            "SELECT COUNT(*) AS total FROM users WHERE last_active_ts >= ?",
             (cutoff,),
         ).fetchone()
     return int(row["total"])
 
 
+def get_user_stats(
+    active_days: int,
+) -> tuple[int, int, Iterable[sqlite3.Row], Iterable[sqlite3.Row]]:
+    return (
+        count_users(),
+        count_active_users(active_days),
+        list_top_purchasers(),
+        list_top_active_users(),
+    )
+
+
 def list_top_purchasers(limit: int = 100) -> Iterable[sqlite3.Row]:
     query = """
         SELECT
-            users.first_name,
-            users.last_name,
-            users.phone,
-            COUNT(orders.id) AS order_count
-        FROM orders
-        JOIN users ON orders.user_id = users.id
-        WHERE orders.status = 'closed'
-        GROUP BY users.id
-        ORDER BY order_count DESC, users.id DESC
+            first_name,
+            last_name,
+            phone,
+            closed_order_count AS order_count
+        FROM users
+        WHERE closed_order_count > 0
+        ORDER BY closed_order_count DESC, id DESC
         LIMIT ?
     """
     with get_connection() as conn:
@@ -1,31 +1,40 @@
 import asyncio
-import json
+import html
 import logging
 import os
 import re
 import sqlite3
-import urllib.parse
-import urllib.request
-from html import escape
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
-from dataclasses import dataclass
-from typing import Optional
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from operator import itemgetter
+from typing import Awaitable, Callable, Iterable, Iterator, Optional
 
+import aiohttp
 from aiogram import BaseMiddleware, Bot, Dispatcher, F, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import TelegramRetryAfter
 from aiogram.filters import CommandStart
+from aiogram.filters.callback_data import CallbackData
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import BaseStorage
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import (InlineKeyboardButton, InlineKeyboardMarkup,
-                           KeyboardButton, ReplyKeyboardMarkup)
+                           InputMediaPhoto, KeyboardButton,
+                           ReplyKeyboardMarkup)
 from aiogram.utils.media_group import MediaGroupBuilder
 
 import db
 
-ADMIN_LIST = {960217500, 8359092913, 5950335991, 45152058, 7746040125}
-GROUP_LIST = {-1003580758940,}
-REPORT_LIST = {960217500,}
+ADMIN_LIST = frozenset({960217500, 8359092913, 5950335991, 45152058, 7746040125})
+GROUP_LIST = frozenset({-1003580758940,})
+REPORT_LIST = frozenset({960217500,})
 
 
 def get_tashkent_tz() -> timezone:
@@ -68,6 +77,7 @@ BTN_BLOCK_USERS = "🚫 Bloklash/ochish"
 BTN_BLOCK = "🔒 Bloklash"
 BTN_UNBLOCK = "🔓 Blokdan chiqarish"
 BTN_CREATE_ORDER = "📝 Buyurtma yaratish"
+BLOCK_ACTIONS = frozenset({BTN_BLOCK, BTN_UNBLOCK})
 
 
 class OrderStates(StatesGroup):
@@ -126,40 +136,208 @@ class ReportStates(StatesGroup):
     end_date = State()
 
 
+class EditProductCallback(CallbackData, prefix="edit"):
+    product_id: int
+
+
+class EditFieldCallback(CallbackData, prefix="field"):
+    name: str
+
+
+class ProductDeleteCallback(CallbackData, prefix="product_delete"):
+    action: str
+    product_id: int
+
+
 @dataclass
 class BroadcastPayload:
     kind: str
     text: Optional[str] = None
-    file_ids: Optional[list[str]] = None
+    source_chat_id: Optional[int] = None
+    source_message_id: Optional[int] = None
     caption: Optional[str] = None
     media_items: Optional[list[dict[str, str]]] = None
 
 
-media_group_buffer: dict[int, dict[str, object]] = {}
-support_reply_map: dict[tuple[int, int], int] = {}
-support_media_group_reject: set[tuple[int, str]] = set()
-admin_media_group_reject: set[tuple[int, str]] = set()
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[object, tuple[float, object]] = OrderedDict()
+
+    def _expire(self, now: float) -> None:
+        while self._data:
+            key, (expires_at, _) = next(iter(self._data.items()))
+            if expires_at > now:
+                break
+            del self._data[key]
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        if item[0] <= time.monotonic():
+            del self._data[key]
+            return default
+        return item[1]
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __setitem__(self, key, value) -> None:
+        now = time.monotonic()
+        self._expire(now)
+        self._data.pop(key, None)
+        self._data[key] = (now + self.ttl, value)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def setdefault(self, key, default):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            self[key] = value = default
+        return value
 
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        self._data.pop(key, None)
+        return value
+
+
+class RateLimiter:
+    def __init__(self, rate: float) -> None:
+        self.interval = 1 / rate
+        self._next_at = 0.0
+
+    async def wait(self) -> None:
+        now = time.monotonic()
+        start_at = max(now, self._next_at)
+        self._next_at = start_at + self.interval
+        if start_at > now:
+            await asyncio.sleep(start_at - now)
+
+
+_MISSING = object()
+
+MEDIA_GROUP_DELAY = 1.2
+background_tasks: set[asyncio.Task] = set()
+active_broadcasts: set[int] = set()
+media_group_buffer = TTLCache(maxsize=4096, ttl=600)
+support_reply_map = TTLCache(maxsize=10_000, ttl=86400)
+SUPPORT_REPLY_KEEP_DAYS = 7
+support_media_group_reject = TTLCache(maxsize=4096, ttl=600)
+admin_media_group_reject = TTLCache(maxsize=4096, ttl=600)
+product_cache = TTLCache(maxsize=1024, ttl=30)
+
+BLOCK_CACHE_TTL = 30.0
+ACTIVITY_FLUSH_INTERVAL = 5.0
+BROADCAST_CONCURRENCY = 30
+BROADCAST_RATE = 30
+BROADCAST_BATCH = 1000
+broadcast_limiter = RateLimiter(BROADCAST_RATE)
+BOT_CONNECTION_LIMIT = 100
+BOT_REQUEST_TIMEOUT = 30
+UPDATE_CONCURRENCY = 200
+REDIS_MAX_CONNECTIONS = 50
+IO_THREADS = 8
+io_executor = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="shrot-io")
+_pending_activity: dict[int, tuple[str, int]] = {}
+_block_cache = TTLCache(maxsize=50_000, ttl=BLOCK_CACHE_TTL)
+
+
+async def cached_is_blocked(user_id: int) -> bool:
+    blocked = _block_cache.get(user_id)
+    if blocked is None:
+        blocked = await asyncio.to_thread(db.is_user_blocked, user_id)
+        _block_cache[user_id] = blocked
+    return blocked
+
+
+def get_product_cached(product_id: int) -> Optional[sqlite3.Row]:
+    product = product_cache.get(product_id)
+    if product is None:
+        product = db.get_product(product_id)
+        if product is not None:
+            product_cache[product_id] = product
+    return product
+
+
+def record_activity(user_id: int) -> None:
+    pending = _pending_activity.get(user_id)
+    count = pending[1] + 1 if pending else 1
+    _pending_activity[user_id] = (db.now_tashkent().isoformat(), count)
+
+
+async def flush_activity() -> None:
+    if not _pending_activity:
+        return
+    entries = [(tg_id, now, count) for tg_id, (now, count) in _pending_activity.items()]
+    _pending_activity.clear()
+    await asyncio.to_thread(db.update_last_active_many, entries)
+
+
+async def run_activity_flush(interval: float = ACTIVITY_FLUSH_INTERVAL) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await flush_activity()
+        except sqlite3.Error:
+            logging.exception("Activity flush failed")
+
+
+class ChatSerialMiddleware(BaseMiddleware):
+    def __init__(self, global_limit: int) -> None:
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._waiters: dict[int, int] = {}
+        self._semaphore = asyncio.Semaphore(global_limit)
 
-class ActivityMiddleware(BaseMiddleware):
     async def __call__(self, handler, event, data):
-        if isinstance(event, types.Message) and event.from_user:
-            if event.chat.type != "private":
-                if (
-                    event.chat.id in GROUP_LIST
-                    and event.reply_to_message
-                    and is_admin(event.from_user.id)
-                ):
+        chat = data.get("event_chat")
+        if chat is None:
+            async with self._semaphore:
+                return await handler(event, data)
+        chat_id = chat.id
+        lock = self._locks.get(chat_id)
+        if lock is None:
+            lock = self._locks[chat_id] = asyncio.Lock()
+        self._waiters[chat_id] = self._waiters.get(chat_id, 0) + 1
+        try:
+            async with lock:
+                async with self._semaphore:
                     return await handler(event, data)
-                return
-            db.update_last_active(event.from_user.id)
+        finally:
+            remaining = self._waiters[chat_id] - 1
+            if remaining:
+                self._waiters[chat_id] = remaining
+            else:
+                del self._waiters[chat_id]
+                del self._locks[chat_id]
+
+
+class ActivityMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        if isinstance(event, types.Message):
+            from_user = event.from_user
+            if from_user:
+                chat = event.chat
+                if chat.type != "private":
+                    if (
+                        chat.id in GROUP_LIST
+                        and event.reply_to_message
+                        and from_user.id in ADMIN_LIST
+                    ):
+                        return await handler(event, data)
+                    return
+                record_activity(from_user.id)
         return await handler(event, data)
 
 
 class BlockedUserMiddleware(BaseMiddleware):
     async def __call__(self, handler, event, data):
-        if isinstance(event, (types.Message, types.CallbackQuery)) and event.from_user:
-            if not is_admin(event.from_user.id) and db.is_user_blocked(event.from_user.id):
+        from_user = event.from_user if isinstance(event, (types.Message, types.CallbackQuery)) else None
+        if from_user:
+            user_id = from_user.id
+            if user_id not in ADMIN_LIST and await cached_is_blocked(user_id):
                 blocked_text = (
                     "⛔️ Siz bloklangansiz.\n"
                     "Admin tomonidan blokdan chiqarilgach botdan foydalanishingiz mumkin."
@@ -178,6 +356,11 @@ def can_view_reports(user_id: int) -> bool:
 
 def user_keyboard(user_id: int, is_admin_override: Optional[bool] = None) -> ReplyKeyboardMarkup:
     is_admin_user = is_admin_override if is_admin_override is not None else is_admin(user_id)
+    return build_user_keyboard(is_admin_user, can_view_reports(user_id))
+
+
+@lru_cache(maxsize=4)
+def build_user_keyboard(is_admin_user: bool, show_reports: bool) -> ReplyKeyboardMarkup:
     rows = [
         [KeyboardButton(text=BTN_PRODUCTS)],
         [KeyboardButton(text=BTN_CONTACT), KeyboardButton(text=BTN_NEWS)],
@@ -188,7 +371,7 @@ def user_keyboard(user_id: int, is_admin_override: Optional[bool] = None) -> Rep
     if is_admin_user:
         rows.append([KeyboardButton(text=BTN_STATS), KeyboardButton(text=BTN_ORDERS_LIST)])
         rows.append([KeyboardButton(text=BTN_CREATE_ORDER)])
-    if can_view_reports(user_id):
+    if show_reports:
         rows.append([KeyboardButton(text=BTN_REPORTS)])
     if is_admin_user:
         rows.append([KeyboardButton(text=BTN_BROADCAST)])
@@ -196,90 +379,102 @@ def user_keyboard(user_id: int, is_admin_override: Optional[bool] = None) -> Rep
     return ReplyKeyboardMarkup(keyboard=rows, resize_keyboard=True)
 
 
+CONTACT_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[[KeyboardButton(text=BTN_SEND_PHONE, request_contact=True)]],
+    resize_keyboard=True,
+    one_time_keyboard=True,
+)
+
+
 def contact_keyboard() -> ReplyKeyboardMarkup:
-    return ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text=BTN_SEND_PHONE, request_contact=True)]],
-        resize_keyboard=True,
-        one_time_keyboard=True,
-    )
+    return CONTACT_KEYBOARD
+
+
+ADD_PRODUCT_PHOTOS_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text=BTN_SKIP_PHOTOS)],
+        [KeyboardButton(text=BTN_CANCEL)],
+    ],
+    resize_keyboard=True,
+)
 
 
 def add_product_photos_keyboard() -> ReplyKeyboardMarkup:
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text=BTN_SKIP_PHOTOS)],
-            [KeyboardButton(text=BTN_CANCEL)],
-        ],
-        resize_keyboard=True,
-    )
+    return ADD_PRODUCT_PHOTOS_KEYBOARD
+
+
+CANCEL_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[[KeyboardButton(text=BTN_CANCEL)]],
+    resize_keyboard=True,
+)
 
 
 def cancel_keyboard() -> ReplyKeyboardMarkup:
-    return ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text=BTN_CANCEL)]],
-        resize_keyboard=True,
-    )
+    return CANCEL_KEYBOARD
+
+
+BLOCK_ACTION_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text=BTN_BLOCK), KeyboardButton(text=BTN_UNBLOCK)],
+        [KeyboardButton(text=BTN_CANCEL)],
+    ],
+    resize_keyboard=True,
+)
 
 
 def block_action_keyboard() -> ReplyKeyboardMarkup:
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text=BTN_BLOCK), KeyboardButton(text=BTN_UNBLOCK)],
-            [KeyboardButton(text=BTN_CANCEL)],
-        ],
-        resize_keyboard=True,
-    )
+    return BLOCK_ACTION_KEYBOARD
+
+
+DESCRIPTION_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[[KeyboardButton(text=BTN_SKIP_DESCRIPTION)], [KeyboardButton(text=BTN_CANCEL)]],
+    resize_keyboard=True,
+)
 
 
 def description_keyboard() -> ReplyKeyboardMarkup:
-    return ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text=BTN_SKIP_DESCRIPTION)], [KeyboardButton(text=BTN_CANCEL)]],
-        resize_keyboard=True,
-    )
+    return DESCRIPTION_KEYBOARD
+
+
+ORDER_ADDRESS_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text=BTN_SEND_LOCATION, request_location=True)],
+        [KeyboardButton(text=BTN_CANCEL)],
+    ],
+    resize_keyboard=True,
+)
 
 
 def order_address_keyboard() -> ReplyKeyboardMarkup:
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text=BTN_SEND_LOCATION, request_location=True)],
-            [KeyboardButton(text=BTN_CANCEL)],
-        ],
-        resize_keyboard=True,
-    )
+    return ORDER_ADDRESS_KEYBOARD
 
 
 def is_cancel_message(message: types.Message) -> bool:
     return bool(message.text and message.text.strip() == BTN_CANCEL)
 
 
-def normalize_phone(value: str) -> str:
-    digits = "".join(char for char in value if char.isdigit())
-    if digits.startswith("998") and len(digits) >= 12:
-        return digits[-9:]
-    return digits
-
-
 def find_user_by_phone(value: str) -> Optional[sqlite3.Row]:
-    normalized = normalize_phone(value)
+    normalized = db.normalize_phone(value)
     if not normalized:
         return None
-    for user in db.list_users():
-        user_phone = normalize_phone(user["phone"] or "")
-        if user_phone == normalized:
-            return user
-    return None
+    return db.find_user_by_normalized_phone(normalized)
 
 
+@lru_cache(maxsize=2048)
+def escape(value: str) -> str:
+    return html.escape(value)
+
+
+@lru_cache(maxsize=2048)
 def format_user_contact(first_name: Optional[str], last_name: Optional[str], phone: Optional[str]) -> str:
-    name_parts = [part for part in [first_name, last_name] if part]
-    full_name = " ".join(name_parts) if name_parts else "Noma'lum foydalanuvchi"
     phone_display = phone or "📞 Telefon yo'q"
-    return f"{full_name} ({phone_display})"
+    return f"{format_user_name(first_name, last_name)} ({phone_display})"
 
 
 def format_user_name(first_name: Optional[str], last_name: Optional[str]) -> str:
-    name_parts = [part for part in [first_name, last_name] if part]
-    return " ".join(name_parts) if name_parts else "Noma'lum foydalanuvchi"
+    if first_name and last_name:
+        return first_name + " " + last_name
+    return first_name or last_name or "Noma'lum foydalanuvchi"
 
 
 async def cancel_admin_action(message: types.Message, state: FSMContext) -> None:
@@ -287,69 +482,97 @@ async def cancel_admin_action(message: types.Message, state: FSMContext) -> None
     await message.answer("❌ Amal bekor qilindi.", reply_markup=user_keyboard(message.from_user.id))
 
 
+@lru_cache(maxsize=2048)
 def product_inline_keyboard(product_id: int, admin: bool) -> InlineKeyboardMarkup:
     buttons = [
         [InlineKeyboardButton(text="🛒 Sotib olish uchun ariza yuborish", callback_data=f"order:{product_id}")]
     ]
     if admin:
-        buttons.append([InlineKeyboardButton(text="✏️ Tahrirlash", callback_data=f"edit:{product_id}")])
+        buttons.append([InlineKeyboardButton(text="✏️ Tahrirlash", callback_data=EditProductCallback(product_id=product_id).pack())])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+ADD_PRODUCT_INLINE_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[[InlineKeyboardButton(text=BTN_ADD_PRODUCT, callback_data="add_product")]]
+)
+
+
+def add_product_inline_keyboard() -> InlineKeyboardMarkup:
+    return ADD_PRODUCT_INLINE_KEYBOARD
+
+
+@lru_cache(maxsize=2048)
 def edit_inline_keyboard(product_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
-        inline_keyboard=[[InlineKeyboardButton(text="✏️ Tahrirlash", callback_data=f"edit:{product_id}")]]
+        inline_keyboard=[[InlineKeyboardButton(text="✏️ Tahrirlash", callback_data=EditProductCallback(product_id=product_id).pack())]]
     )
 
 
+EDIT_FIELDS_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [InlineKeyboardButton(text="📝 Nomi", callback_data=EditFieldCallback(name="name").pack())],
+        [InlineKeyboardButton(text="💰 Narxi", callback_data=EditFieldCallback(name="price").pack())],
+        [InlineKeyboardButton(text="🗒 Tavsif", callback_data=EditFieldCallback(name="description").pack())],
+        [InlineKeyboardButton(text="🖼 Rasmlar", callback_data=EditFieldCallback(name="photos").pack())],
+        [InlineKeyboardButton(text="🗑 O'chirish", callback_data=EditFieldCallback(name="delete").pack())],
+    ]
+)
+
+
 def edit_fields_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="📝 Nomi", callback_data="field:name")],
-            [InlineKeyboardButton(text="💰 Narxi", callback_data="field:price")],
-            [InlineKeyboardButton(text="🗒 Tavsif", callback_data="field:description")],
-            [InlineKeyboardButton(text="🖼 Rasmlar", callback_data="field:photos")],
-            [InlineKeyboardButton(text="🗑 O'chirish", callback_data="field:delete")],
-        ]
-    )
+    return EDIT_FIELDS_KEYBOARD
+
+
+NEWS_INLINE_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [InlineKeyboardButton(text="Telegram", url="https://t.me/shrotsavdo")],
+        [InlineKeyboardButton(text="Instagram", url="https://instagram.com/shrotsavdo")],
+    ]
+)
 
 
 def news_inline_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Telegram", url="https://t.me/shrotsavdo")],
-            [InlineKeyboardButton(text="Instagram", url="https://instagram.com/shrotsavdo")],
-        ]
-    )
+    return NEWS_INLINE_KEYBOARD
 
 
+@lru_cache(maxsize=2048)
 def delete_product_confirm_keyboard(product_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
             [
                 InlineKeyboardButton(
-                    text="✅ Ha, o'chirish", callback_data=f"product_delete:confirm:{product_id}"
+                    text="✅ Ha, o'chirish",
+                    callback_data=ProductDeleteCallback(action="confirm", product_id=product_id).pack(),
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    text="↩️ Yo'q",
+                    callback_data=ProductDeleteCallback(action="cancel", product_id=product_id).pack(),
                 )
             ],
-            [InlineKeyboardButton(text="↩️ Yo'q", callback_data=f"product_delete:cancel:{product_id}")],
         ]
     )
 
 
+ORDERS_STATUS_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(text="🟢 Yopilmagan statuslar", callback_data="orders:open"),
+            InlineKeyboardButton(text="✅ Yopilgan statuslar", callback_data="orders:closed:0"),
+        ],
+        [InlineKeyboardButton(text="❌ Bekor qilingan statuslar", callback_data="orders:canceled:0")],
+        [InlineKeyboardButton(text="🔎 ID bo'yicha qidirish", callback_data="orders:search")],
+        [InlineKeyboardButton(text="🗑 Buyurtmani o'chirish", callback_data="orders:delete")],
+    ]
+)
+
+
 def orders_status_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
-                InlineKeyboardButton(text="🟢 Yopilmagan statuslar", callback_data="orders:open"),
-                InlineKeyboardButton(text="✅ Yopilgan statuslar", callback_data="orders:closed:0"),
-            ],
-            [InlineKeyboardButton(text="❌ Bekor qilingan statuslar", callback_data="orders:canceled:0")],
-            [InlineKeyboardButton(text="🔎 ID bo'yicha qidirish", callback_data="orders:search")],
-            [InlineKeyboardButton(text="🗑 Buyurtmani o'chirish", callback_data="orders:delete")],
-        ]
-    )
+    return ORDERS_STATUS_KEYBOARD
 
 
+@lru_cache(maxsize=2048)
 def order_action_keyboard(order_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -359,6 +582,7 @@ def order_action_keyboard(order_id: int) -> InlineKeyboardMarkup:
     )
 
 
+@lru_cache(maxsize=2048)
 def order_cancel_confirm_keyboard(order_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -368,15 +592,19 @@ def order_cancel_confirm_keyboard(order_id: int) -> InlineKeyboardMarkup:
     )
 
 
+ORDER_DELETE_CONFIRM_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [InlineKeyboardButton(text="✅ Ha, o'chirish", callback_data="orders:delete_confirm")],
+        [InlineKeyboardButton(text="↩️ Yo'q", callback_data="orders:delete_keep")],
+    ]
+)
+
+
 def order_delete_confirm_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="✅ Ha, o'chirish", callback_data="orders:delete_confirm")],
-            [InlineKeyboardButton(text="↩️ Yo'q", callback_data="orders:delete_keep")],
-        ]
-    )
+    return ORDER_DELETE_CONFIRM_KEYBOARD
 
 
+@lru_cache(maxsize=2048)
 def user_order_action_keyboard(order_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -385,6 +613,7 @@ def user_order_action_keyboard(order_id: int) -> InlineKeyboardMarkup:
     )
 
 
+@lru_cache(maxsize=2048)
 def user_order_cancel_confirm_keyboard(order_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -394,28 +623,39 @@ def user_order_cancel_confirm_keyboard(order_id: int) -> InlineKeyboardMarkup:
     )
 
 
+ORDER_CONFIRM_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [InlineKeyboardButton(text="✅ Buyurtmani tasdiqlash", callback_data="order_confirm")],
+        [InlineKeyboardButton(text="❌ Bekor qilish", callback_data="order_cancel")],
+    ]
+)
+
+
 def order_confirm_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="✅ Buyurtmani tasdiqlash", callback_data="order_confirm")],
-            [InlineKeyboardButton(text="❌ Bekor qilish", callback_data="order_cancel")],
-        ]
-    )
+    return ORDER_CONFIRM_KEYBOARD
+
+
+ADMIN_ORDER_CONFIRM_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [InlineKeyboardButton(text="✅ Ha", callback_data="admin_order_confirm")],
+        [InlineKeyboardButton(text="❌ Yo'q", callback_data="admin_order_cancel")],
+    ]
+)
 
 
 def admin_order_confirm_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="✅ Ha", callback_data="admin_order_confirm")],
-            [InlineKeyboardButton(text="❌ Yo'q", callback_data="admin_order_cancel")],
-        ]
-    )
+    return ADMIN_ORDER_CONFIRM_KEYBOARD
 
 
 def admin_order_products_keyboard(products: list[sqlite3.Row]) -> InlineKeyboardMarkup:
+    return build_products_keyboard(tuple((product["id"], product["name"]) for product in products))
+
+
+@lru_cache(maxsize=32)
+def build_products_keyboard(products: tuple[tuple[int, str], ...]) -> InlineKeyboardMarkup:
     rows = [
-        [InlineKeyboardButton(text=product["name"], callback_data=f"admin_order_product:{product['id']}")]
-        for product in products
+        [InlineKeyboardButton(text=name, callback_data=f"admin_order_product:{product_id}")]
+        for product_id, name in products
     ]
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
@@ -426,44 +666,80 @@ def format_location_link(latitude: Optional[float], longitude: Optional[float])
     return f"https://www.google.com/maps?q={latitude},{longitude}"
 
 
+ORDER_MESSAGE_TEMPLATE = (
+    "%s"
+    "👤 Ism: %s\n"
+    "📦 Mahsulot: %s\n"
+    "⚖️ Miqdor: %s\n"
+    "💰 Narx (1 kg, ariza vaqti): %s сум\n"
+    "💵 Jami: %s\n"
+    "📞 Telefon: %s\n"
+    "%s"
+    "📅 Sana: %s"
+)
+USER_ORDER_MESSAGE_TEMPLATE = (
+    "🆔 ID: %s\n"
+    "📦 Mahsulot: %s\n"
+    "⚖️ Miqdor: %s\n"
+    "💰 Narx (1 kg, ariza vaqti): %s сум\n"
+    "💵 Jami: %s\n"
+    "📍 Manzil: %s\n"
+    "📌 Holati: %s\n"
+    "📅 Sana: %s"
+)
+STATS_MESSAGE_TEMPLATE = (
+    "📊 Statistika:\n"
+    "👥 Umumiy foydalanuvchilar: %s\n"
+    "🔥 So'nggi 30 kunda faol: %s\n\n"
+    "🏆 Ko'p marta buyurtma bergan foydalanuvchilar:\n"
+    "%s\n\n"
+    "🚀 Botdan ko'p foydalanadigan foydalanuvchilar:\n"
+    "%s"
+)
+ORDERS_SUMMARY_TEMPLATE = (
+    "🧾 Zayavkalar bo'yicha ma'lumot:\n"
+    "📦 Umumiy: %s\n"
+    "✅ Yopilgan: %s\n"
+    "❌ Bekor qilingan: %s\n"
+    "🟢 Ochiq: %s"
+)
+
+
 def format_order_message(order, include_id: bool = True, include_address: bool = True) -> str:
-    person = escape(format_order_person(order["first_name"], order["last_name"]))
-    created_at = escape(format_order_datetime(order["created_at"]))
     price_per_kg = order["order_price_per_kg"] or order["product_price_per_kg"]
-    lines = []
-    if include_id:
-        lines.append(f"🆔 ID: {escape(str(order['id']))}")
-    lines.extend(
-        [
-            f"👤 Ism: {person}",
-            f"📦 Mahsulot: {escape(order['product_name'])}",
-            f"⚖️ Miqdor: {escape(order['quantity'])}",
-            f"💰 Narx (1 kg, ariza vaqti): {escape(format_price(price_per_kg))} сум",
-            f"💵 Jami: {escape(format_deal_price(order['quantity'], price_per_kg))}",
-            f"📞 Telefon: {escape(order['phone'] or 'Kiritilmagan')}",
-        ]
-    )
+    quantity = order["quantity"]
+    address_part = ""
     if include_address:
-        lines.append(f"📍 Manzil: {escape(order['address'])}")
+        address_part = f"📍 Manzil: {escape(order['address'])}\n"
         location_link = format_location_link(order["latitude"], order["longitude"])
         if location_link:
-            lines.append(f"🗺 Lokatsiya: <a href=\"{escape(location_link)}\">Manzilga utish</a>")
-    lines.append(f"📅 Sana: {created_at}")
-    return "\n".join(lines)
+            address_part += f"🗺 Lokatsiya: <a href=\"{escape(location_link)}\">Manzilga utish</a>\n"
+    return ORDER_MESSAGE_TEMPLATE % (
+        f"🆔 ID: {order['id']}\n" if include_id else "",
+        escape(format_order_person(order["first_name"], order["last_name"])),
+        escape(order["product_name"]),
+        escape(quantity),
+        format_price(price_per_kg),
+        format_deal_price(quantity, price_per_kg),
+        escape(order["phone"] or "Kiritilmagan"),
+        address_part,
+        escape(format_order_datetime(order["created_at"])),
+    )
+
+
+STATUS_LABELS = {
+    "open": "🟢 Ochiq",
+    "closed": "✅ Qabul qilingan va yopilgan",
+    "canceled": "❌ Bekor qilingan",
+}
+CANCELED_STATUS_LABELS = {
+    ("canceled", "user"): "❌ Bekor qilish va yopish",
+    ("canceled", "admin"): "⚠️ Admin tomonidan bekor qilingan",
+}
 
 
 def format_status_label(status: str, canceled_by_role: Optional[str]) -> str:
-    if status == "open":
-        return "🟢 Ochiq"
-    if status == "closed":
-        return "✅ Qabul qilingan va yopilgan"
-    if status == "canceled" and canceled_by_role == "user":
-        return "❌ Bekor qilish va yopish"
-    if status == "canceled" and canceled_by_role == "admin":
-        return "⚠️ Admin tomonidan bekor qilingan"
-    if status == "canceled":
-        return "❌ Bekor qilingan"
-    return status
+    return CANCELED_STATUS_LABELS.get((status, canceled_by_role)) or STATUS_LABELS.get(status, status)
 
 
 def format_admin_order_details(order) -> str:
@@ -477,20 +753,18 @@ def format_admin_order_details(order) -> str:
 
 
 def format_user_order_message(order) -> str:
-    created_at = escape(format_order_datetime(order["created_at"]))
     price_per_kg = order["order_price_per_kg"] or order["product_price_per_kg"]
-    status_label = format_status_label(order["status"], order["canceled_by_role"])
-    lines = [
-        f"🆔 ID: {escape(str(order['id']))}",
-        f"📦 Mahsulot: {escape(order['product_name'])}",
-        f"⚖️ Miqdor: {escape(order['quantity'])}",
-        f"💰 Narx (1 kg, ariza vaqti): {escape(format_price(price_per_kg))} сум",
-        f"💵 Jami: {escape(format_deal_price(order['quantity'], price_per_kg))}",
-        f"📍 Manzil: {escape(order['address'])}",
-        f"📌 Holati: {escape(status_label)}",
-        f"📅 Sana: {created_at}",
-    ]
-    return "\n".join(lines)
+    quantity = order["quantity"]
+    return USER_ORDER_MESSAGE_TEMPLATE % (
+        order["id"],
+        escape(order["product_name"]),
+        escape(quantity),
+        format_price(price_per_kg),
+        format_deal_price(quantity, price_per_kg),
+        escape(order["address"]),
+        escape(format_status_label(order["status"], order["canceled_by_role"])),
+        escape(format_order_datetime(order["created_at"])),
+    )
 
 
 async def notify_admins_new_order(bot: Bot, order_id: int) -> None:
@@ -498,18 +772,20 @@ async def notify_admins_new_order(bot: Bot, order_id: int) -> None:
     if not order:
         return
     text = "🆕 Yangi ariza:\n" + format_order_message(order)
-    for admin_id in ADMIN_LIST:
-        try:
-            await bot.send_message(
-                admin_id,
-                text,
-                reply_markup=order_action_keyboard(order_id),
-                parse_mode="HTML",
-            )
-        except Exception:
-            continue
+    keyboard = order_action_keyboard(order_id)
+    results = await asyncio.gather(
+        *(
+            bot.send_message(admin_id, text, reply_markup=keyboard, parse_mode="HTML")
+            for admin_id in ADMIN_LIST
+        ),
+        return_exceptions=True,
+    )
+    for admin_id, result in zip(ADMIN_LIST, results):
+        if isinstance(result, Exception):
+            logging.warning("Failed to notify admin %s about order %s: %s", admin_id, order_id, result)
 
 
+@lru_cache(maxsize=4096)
 def format_order_datetime(value: str) -> str:
     try:
         parsed = datetime.fromisoformat(value)
@@ -521,34 +797,53 @@ def format_order_datetime(value: str) -> str:
 
 
 def format_order_person(first_name: Optional[str], last_name: Optional[str]) -> str:
-    parts = [part for part in [first_name, last_name] if part]
-    return " ".join(parts) if parts else "👤 Noma'lum"
+    if first_name and last_name:
+        return first_name + " " + last_name
+    return first_name or last_name or "👤 Noma'lum"
 
 
 def format_price(value: Optional[float]) -> str:
     if value is None:
         return "⚠️ Kiritilmagan"
-    if abs(value - round(value)) < 1e-9:
-        return str(int(round(value)))
+    if type(value) is int:
+        return str(value)
+    rounded = round(value)
+    if abs(value - rounded) < 1e-9:
+        return str(int(rounded))
     return f"{value:.2f}".rstrip("0").rstrip(".")
 
 
+@lru_cache(maxsize=1024)
 def format_money_with_commas(value: Optional[float]) -> str:
     if value is None:
         return "⚠️ Kiritilmagan"
-    if abs(value - round(value)) < 1e-9:
-        return f"{int(round(value)):,}"
+    if type(value) is int:
+        return f"{value:,}"
+    rounded = round(value)
+    if abs(value - rounded) < 1e-9:
+        return f"{int(rounded):,}"
     return f"{value:,.2f}".rstrip("0").rstrip(".")
 
 
+ISO_DATE_RE = re.compile(r"(\d{4})-(\d{1,2})-(\d{1,2})")
+DOTTED_DATE_RE = re.compile(r"(\d{1,2})\.(\d{1,2})\.(\d{4})")
+
+
+@lru_cache(maxsize=1024)
 def parse_report_date(value: str) -> Optional[datetime]:
     cleaned = value.strip()
-    for fmt in ("%Y-%m-%d", "%d.%m.%Y"):
-        try:
-            return datetime.strptime(cleaned, fmt)
-        except ValueError:
-            continue
-    return None
+    match = ISO_DATE_RE.fullmatch(cleaned)
+    if match:
+        year, month, day = match.groups()
+    else:
+        match = DOTTED_DATE_RE.fullmatch(cleaned)
+        if not match:
+            return None
+        day, month, year = match.groups()
+    try:
+        return datetime(int(year), int(month), int(day))
+    except ValueError:
+        return None
 
 
 def format_report_period(start_date: datetime, end_date: datetime) -> str:
@@ -556,19 +851,25 @@ def format_report_period(start_date: datetime, end_date: datetime) -> str:
 
 
 def format_tons(value: float) -> str:
-    if abs(value - round(value)) < 1e-9:
-        return str(int(round(value)))
+    if type(value) is int:
+        return str(value)
+    rounded = round(value)
+    if abs(value - rounded) < 1e-9:
+        return str(int(rounded))
     return f"{value:,.2f}".rstrip("0").rstrip(".")
 
 
-def calculate_report_stats(
-    rows: list[sqlite3.Row],
-) -> tuple[float, float, list[dict[str, object]]]:
+ReportStats = tuple[float, float, list[dict[str, object]]]
+
+
+def calculate_report_stats(rows: Iterable[sqlite3.Row]) -> ReportStats:
     per_client_product: dict[tuple[int, str], dict[str, object]] = {}
+    user_names: dict[int, str] = {}
+    parse_kg = parse_quantity_to_kg
     total_sum = 0.0
     total_tons = 0.0
     for row in rows:
-        qty_kg = parse_quantity_to_kg(row["quantity"])
+        qty_kg = parse_kg(row["quantity"])
         price_per_kg = row["order_price_per_kg"] or row["product_price_per_kg"]
         if qty_kg is None or price_per_kg is None:
             continue
@@ -576,33 +877,39 @@ def calculate_report_stats(
         tons = qty_kg / 1000
         total_sum += amount
         total_tons += tons
-        key = (row["user_id"], row["product_name"])
-        entry = per_client_product.setdefault(
-            key,
-            {
-                "name": format_user_contact(row["first_name"], row["last_name"], row["phone"]),
-                "product": row["product_name"],
+        user_id = row["user_id"]
+        product_name = row["product_name"]
+        key = (user_id, product_name)
+        entry = per_client_product.get(key)
+        if entry is None:
+            name = user_names.get(user_id)
+            if name is None:
+                name = user_names[user_id] = format_user_contact(
+                    row["first_name"], row["last_name"], row["phone"]
+                )
+            entry = per_client_product[key] = {
+                "name": name,
+                "product": product_name,
                 "tons": 0.0,
                 "amount": 0.0,
-            },
-        )
+            }
         entry["tons"] += tons
         entry["amount"] += amount
     sorted_entries = sorted(
         per_client_product.values(),
-        key=lambda item: item["amount"],
+        key=itemgetter("amount"),
         reverse=True,
     )
     return total_sum, total_tons, sorted_entries
 
 
 def build_report_summary_text(
-    rows: list[sqlite3.Row],
+    stats: ReportStats,
     start_date: datetime,
     end_date: datetime,
     limit: int = 20,
 ) -> str:
-    total_sum, total_tons, entries = calculate_report_stats(rows)
+    total_sum, total_tons, entries = stats
     period_label = format_report_period(start_date, end_date)
     total_sum_label = format_money_with_commas(total_sum)
     total_tons_label = format_tons(total_tons)
@@ -625,133 +932,129 @@ def build_report_summary_text(
     return "\n".join(lines)
 
 
-def build_report_html(
-    rows: list[sqlite3.Row],
-    start_date: datetime,
-    end_date: datetime,
-) -> str:
-    total_sum, total_tons, entries = calculate_report_stats(rows)
-    rows_html = []
-    for idx, entry in enumerate(entries, start=1):
-        rows_html.append(
-            "<tr>"
-            f"<td data-label=\"#\">{idx}</td>"
-            f"<td data-label=\"Mijoz\" data-key=\"name\" data-value=\"{escape(entry['name'])}\">"
-            f"{escape(entry['name'])}"
-            "</td>"
-            f"<td data-label=\"Mahsulot\" data-key=\"product\" data-value=\"{escape(entry['product'])}\">"
-            f"{escape(entry['product'])}"
-            "</td>"
-            "<td data-label=\"Tonna (t)\" data-key=\"tons\" "
-            f"data-value=\"{entry['tons']}\" style=\"text-align:right;\">"
-            f"{escape(format_tons(entry['tons']))}"
-            "</td>"
-            "<td data-label=\"Jami summa (so'm)\" data-key=\"amount\" "
-            f"data-value=\"{entry['amount']}\" style=\"text-align:right;\">"
-            f"{escape(format_money_with_commas(entry['amount']))}"
-            "</td>"
-            "</tr>"
-        )
-    if not rows_html:
-        rows_html.append(
-            "<tr><td colspan=\"5\" style=\"text-align:center; padding: 16px;\">"
-            "Ma'lumot topilmadi"
-            "</td></tr>"
-        )
-    period_label = format_report_period(start_date, end_date)
-    total_sum_label = escape(format_money_with_commas(total_sum))
-    total_tons_label = escape(format_tons(total_tons))
-    return f"""<!DOCTYPE html>
-<html lang="uz">
-<head>
-  <meta charset="UTF-8" />
-  <meta name="viewport" content="width=device-width, initial-scale=1.0" />
-  <title>Hisobot</title>
-  <style>
-    body {{
+REPORT_WRITE_BUFFER = 1 << 16
+REPORT_ROW_TEMPLATE = (
+    "<tr>"
+    "<td data-label=\"#\">%d</td>"
+    "<td data-label=\"Mijoz\" data-key=\"name\" data-value=\"%s\">%s</td>"
+    "<td data-label=\"Mahsulot\" data-key=\"product\" data-value=\"%s\">%s</td>"
+    "<td data-label=\"Tonna (t)\" data-key=\"tons\" "
+    "data-value=\"%s\" style=\"text-align:right;\">%s</td>"
+    "<td data-label=\"Jami summa (so'm)\" data-key=\"amount\" "
+    "data-value=\"%s\" style=\"text-align:right;\">%s</td>"
+    "</tr>"
+)
+
+
+REPORT_EMPTY_ROW = (
+    "<tr><td colspan=\"5\" style=\"text-align:center; padding: 16px;\">"
+    "Ma'lumot topilmadi"
+    "</td></tr>"
+)
+
+
+def format_report_row(idx: int, entry: dict[str, object]) -> str:
+    name = escape(entry["name"])
+    product = escape(entry["product"])
+    tons = entry["tons"]
+    amount = entry["amount"]
+    return REPORT_ROW_TEMPLATE % (
+        idx,
+        name,
+        name,
+        product,
+        product,
+        tons,
+        escape(format_tons(tons)),
+        amount,
+        escape(format_money_with_commas(amount)),
+    )
+
+
+REPORT_CSS = """    body {
       font-family: "Segoe UI", Arial, sans-serif;
       background: #f5f7fb;
       color: #1f2a44;
       margin: 0;
       padding: 24px;
-    }}
-    * {{
+    }
+    * {
       box-sizing: border-box;
-    }}
-    .card {{
+    }
+    .card {
       max-width: 900px;
       margin: 0 auto;
       background: #ffffff;
       border-radius: 16px;
       box-shadow: 0 12px 30px rgba(15, 23, 42, 0.12);
       padding: 24px;
-    }}
-    h1 {{
+    }
+    h1 {
       margin: 0 0 8px;
       font-size: 24px;
-    }}
-    .period {{
+    }
+    .period {
       color: #64748b;
       margin-bottom: 16px;
-    }}
-    table {{
+    }
+    table {
       width: 100%;
       border-collapse: collapse;
       margin-top: 16px;
-    }}
-    th, td {{
+    }
+    th, td {
       padding: 12px;
       border-bottom: 1px solid #e2e8f0;
       font-size: 14px;
-    }}
-    th {{
+    }
+    th {
       text-align: left;
       background: #f1f5f9;
       color: #475569;
-    }}
-    th.sortable {{
+    }
+    th.sortable {
       cursor: pointer;
       user-select: none;
-    }}
-    .toolbar {{
+    }
+    .toolbar {
       display: flex;
       justify-content: space-between;
       align-items: center;
       gap: 12px;
       flex-wrap: wrap;
       margin: 12px 0 4px;
-    }}
-    .sort-buttons {{
+    }
+    .sort-buttons {
       display: none;
       gap: 8px;
       flex-wrap: wrap;
-    }}
-    .sort-button {{
+    }
+    .sort-button {
       padding: 8px 12px;
       border-radius: 10px;
       border: 1px solid #e2e8f0;
       background: #f8fafc;
       font-size: 12px;
       cursor: pointer;
-    }}
-    .search-input {{
+    }
+    .search-input {
       flex: 1 1 240px;
       padding: 10px 12px;
       border: 1px solid #e2e8f0;
       border-radius: 10px;
       font-size: 14px;
-    }}
-    .hint {{
+    }
+    .hint {
       font-size: 12px;
       color: #64748b;
-    }}
-    td[data-label]::before {{
+    }
+    td[data-label]::before {
       content: attr(data-label);
       display: none;
       font-weight: 600;
       color: #475569;
-    }}
-    .total {{
+    }
+    .total {
       margin-top: 20px;
       padding: 16px;
       background: #0f172a;
@@ -759,208 +1062,269 @@ def build_report_html(
       border-radius: 12px;
       text-align: right;
       font-weight: 600;
-    }}
-    @media (max-width: 600px) {{
-      body {{
+    }
+    @media (max-width: 600px) {
+      body {
         padding: 16px;
-      }}
-      .card {{
+      }
+      .card {
         padding: 16px;
-      }}
-      table {{
+      }
+      table {
         border: 0;
-      }}
-      thead {{
+      }
+      thead {
         display: none;
-      }}
-      tr {{
+      }
+      tr {
         display: block;
         margin-bottom: 12px;
         border: 1px solid #e2e8f0;
         border-radius: 12px;
         padding: 8px;
-      }}
-      td {{
+      }
+      td {
         display: flex;
         justify-content: space-between;
         gap: 12px;
         padding: 8px 6px;
         border: none;
-      }}
-      td[data-label]::before {{
+      }
+      td[data-label]::before {
         display: block;
-      }}
-      .total {{
+      }
+      .total {
         text-align: left;
-      }}
-      .toolbar {{
+      }
+      .toolbar {
         flex-direction: column;
         align-items: stretch;
-      }}
-      .search-input {{
+      }
+      .search-input {
         font-size: 12px;
         padding: 6px 8px;
         line-height: 1.2;
-      }}
-      .sort-buttons {{
+      }
+      .sort-buttons {
         display: flex;
-      }}
-    }}
-  </style>
-</head>
-<body>
-  <div class="card">
-    <h1>Hisobot</h1>
-    <div class="period">Davr: {escape(period_label)}</div>
-    <div class="toolbar">
-      <input id="searchInput" class="search-input" type="text" placeholder="Qidirish: mijoz, mahsulot, tonna yoki summa" />
-      <div class="hint">Sarlavhalarni bosib saralang (Mijoz, Mahsulot, Tonna, Jami summa)</div>
-    </div>
-    <div class="sort-buttons" aria-label="Saralash tugmalari">
-      <button type="button" class="sort-button" data-sort="name">Mijoz</button>
-      <button type="button" class="sort-button" data-sort="product">Mahsulot</button>
-      <button type="button" class="sort-button" data-sort="tons">Tonna</button>
-      <button type="button" class="sort-button" data-sort="amount">Jami summa</button>
-    </div>
-    <table>
-      <thead>
-        <tr>
-          <th>#</th>
-          <th class="sortable" data-sort="name">Mijoz</th>
-          <th class="sortable" data-sort="product">Mahsulot</th>
-          <th class="sortable" data-sort="tons" style="text-align:right;">Tonna (t)</th>
-          <th class="sortable" data-sort="amount" style="text-align:right;">Jami summa (so'm)</th>
-        </tr>
-      </thead>
-      <tbody>
-        {''.join(rows_html)}
-      </tbody>
-    </table>
-    <div class="total">Umumiy summa: {total_sum_label} so'm · Jami tonna: {total_tons_label} t</div>
-  </div>
-  <script>
-    const tbody = document.querySelector("tbody");
+      }
+    }
+"""
+
+REPORT_SCRIPT = """    const tbody = document.querySelector("tbody");
     const rows = Array.from(tbody.querySelectorAll("tr"));
     const totalElement = document.querySelector(".total");
-    const sortState = {{ name: "desc", product: "asc", tons: "asc", amount: "asc" }};
+    const sortState = { name: "desc", product: "asc", tons: "asc", amount: "asc" };
 
-    const getCellValue = (row, key) => {{
-      const cell = row.querySelector(`[data-key="${{key}}"]`);
+    const getCellValue = (row, key) => {
+      const cell = row.querySelector(`[data-key="${key}"]`);
       if (!cell) return "";
-      if (key === "name" || key === "product") {{
+      if (key === "name" || key === "product") {
         return (cell.dataset.value || cell.textContent).trim().toLowerCase();
-      }}
+      }
       const num = parseFloat(cell.dataset.value || "0");
       return Number.isNaN(num) ? 0 : num;
-    }};
+    };
 
-    const formatNumber = (value) => {{
-      if (Math.abs(value - Math.round(value)) < 1e-9) {{
+    const formatNumber = (value) => {
+      if (Math.abs(value - Math.round(value)) < 1e-9) {
         return Math.round(value).toLocaleString("en-US");
-      }}
-      return value.toLocaleString("en-US", {{
+      }
+      return value.toLocaleString("en-US", {
         minimumFractionDigits: 0,
         maximumFractionDigits: 2,
-      }});
-    }};
+      });
+    };
 
-    const updateTotals = () => {{
+    const updateTotals = () => {
       let sum = 0;
       let tons = 0;
-      rows.forEach((row) => {{
-        if (row.style.display === "none") {{
+      rows.forEach((row) => {
+        if (row.style.display === "none") {
           return;
-        }}
+        }
         const amountCell = row.querySelector('[data-key="amount"]');
         const tonsCell = row.querySelector('[data-key="tons"]');
-        if (!amountCell || !tonsCell) {{
+        if (!amountCell || !tonsCell) {
           return;
-        }}
+        }
         const amountValue = parseFloat(amountCell.dataset.value || "0");
         const tonsValue = parseFloat(tonsCell.dataset.value || "0");
-        if (!Number.isNaN(amountValue)) {{
+        if (!Number.isNaN(amountValue)) {
           sum += amountValue;
-        }}
-        if (!Number.isNaN(tonsValue)) {{
+        }
+        if (!Number.isNaN(tonsValue)) {
           tons += tonsValue;
-        }}
-      }});
-      totalElement.textContent = `Umumiy summa: ${{formatNumber(sum)}} so'm · Jami tonna: ${{formatNumber(tons)}} t`;
-    }};
+        }
+      });
+      totalElement.textContent = `Umumiy summa: ${formatNumber(sum)} so'm · Jami tonna: ${formatNumber(tons)} t`;
+    };
 
-    const sortRows = (key) => {{
+    const sortRows = (key) => {
       const direction = sortState[key] === "asc" ? "desc" : "asc";
       sortState[key] = direction;
-      rows.sort((a, b) => {{
+      rows.sort((a, b) => {
         const av = getCellValue(a, key);
         const bv = getCellValue(b, key);
-        if (key === "name" || key === "product") {{
+        if (key === "name" || key === "product") {
           if (av < bv) return direction === "asc" ? -1 : 1;
           if (av > bv) return direction === "asc" ? 1 : -1;
           return 0;
-        }}
+        }
         return direction === "asc" ? av - bv : bv - av;
-      }});
+      });
       rows.forEach((row) => tbody.appendChild(row));
-    }};
+    };
 
-    const bindSort = (selector) => {{
-      document.querySelectorAll(selector).forEach((element) => {{
+    const bindSort = (selector) => {
+      document.querySelectorAll(selector).forEach((element) => {
         element.addEventListener("click", () => sortRows(element.dataset.sort));
-      }});
-    }};
+      });
+    };
 
     bindSort("th[data-sort]");
     bindSort("button[data-sort]");
 
     const searchInput = document.getElementById("searchInput");
-    searchInput.addEventListener("input", (event) => {{
+    searchInput.addEventListener("input", (event) => {
       const query = event.target.value.trim().toLowerCase();
-      rows.forEach((row) => {{
+      rows.forEach((row) => {
         const rowText = row.textContent.toLowerCase();
         row.style.display = rowText.includes(query) ? "" : "none";
-      }});
+      });
       updateTotals();
-    }});
+    });
 
     updateTotals();
-  </script>
+"""
+
+REPORT_HTML_HEAD = """<!DOCTYPE html>
+<html lang="uz">
+<head>
+  <meta charset="UTF-8" />
+  <meta name="viewport" content="width=device-width, initial-scale=1.0" />
+  <title>Hisobot</title>
+  <style>
+""" + REPORT_CSS + """  </style>
+</head>
+<body>
+  <div class="card">
+    <h1>Hisobot</h1>
+    <div class="period">Davr: """
+REPORT_HTML_TABLE = """</div>
+    <div class="toolbar">
+      <input id="searchInput" class="search-input" type="text" placeholder="Qidirish: mijoz, mahsulot, tonna yoki summa" />
+      <div class="hint">Sarlavhalarni bosib saralang (Mijoz, Mahsulot, Tonna, Jami summa)</div>
+    </div>
+    <div class="sort-buttons" aria-label="Saralash tugmalari">
+      <button type="button" class="sort-button" data-sort="name">Mijoz</button>
+      <button type="button" class="sort-button" data-sort="product">Mahsulot</button>
+      <button type="button" class="sort-button" data-sort="tons">Tonna</button>
+      <button type="button" class="sort-button" data-sort="amount">Jami summa</button>
+    </div>
+    <table>
+      <thead>
+        <tr>
+          <th>#</th>
+          <th class="sortable" data-sort="name">Mijoz</th>
+          <th class="sortable" data-sort="product">Mahsulot</th>
+          <th class="sortable" data-sort="tons" style="text-align:right;">Tonna (t)</th>
+          <th class="sortable" data-sort="amount" style="text-align:right;">Jami summa (so'm)</th>
+        </tr>
+      </thead>
+      <tbody>
+        """
+REPORT_HTML_TOTAL = """
+      </tbody>
+    </table>
+    <div class="total">Umumiy summa: """
+REPORT_HTML_TAIL = """ t</div>
+  </div>
+  <script>
+""" + REPORT_SCRIPT + """  </script>
 </body>
 </html>"""
 
 
+def iter_report_html(
+    stats: ReportStats,
+    start_date: datetime,
+    end_date: datetime,
+) -> Iterator[str]:
+    total_sum, total_tons, entries = stats
+    yield REPORT_HTML_HEAD
+    yield escape(format_report_period(start_date, end_date))
+    yield REPORT_HTML_TABLE
+    if entries:
+        for idx, entry in enumerate(entries, start=1):
+            yield format_report_row(idx, entry)
+    else:
+        yield REPORT_EMPTY_ROW
+    yield REPORT_HTML_TOTAL
+    yield escape(format_money_with_commas(total_sum))
+    yield " so'm · Jami tonna: "
+    yield escape(format_tons(total_tons))
+    yield REPORT_HTML_TAIL
+
+
+QTY_RE = re.compile(r"([0-9]+(?:[.,][0-9]+)?)")
+QTY_TONS_RE = re.compile(r"\d+(?:[.,]\d+)?")
+
+
 def parse_quantity_to_kg(value: str) -> Optional[float]:
     cleaned = value.strip().lower()
-    match = re.search(r"([0-9]+(?:[.,][0-9]+)?)", cleaned)
+    match = QTY_RE.search(cleaned)
     if not match:
         return None
-    number = float(match.group(1).replace(",", "."))
-    if any(unit in cleaned for unit in ["tonna", "t"]):
+    raw = match.group(1)
+    if "," in raw:
+        raw = raw.replace(",", ".")
+    number = float(raw)
+    if "t" in cleaned:
         return number * 1000
     return number
 
 
 def parse_quantity_to_tons(value: str) -> Optional[float]:
     cleaned = value.strip()
-    if not re.fullmatch(r"\d+(?:[.,]\d+)?", cleaned):
+    if not QTY_TONS_RE.fullmatch(cleaned):
         return None
-    return float(cleaned.replace(",", "."))
+    if "," in cleaned:
+        cleaned = cleaned.replace(",", ".")
+    return float(cleaned)
 
 
 def format_deal_price(quantity: str, price_per_kg: Optional[float]) -> str:
     if price_per_kg is None:
         return "⚠️ Hisoblab bo'lmadi"
-    qty_kg = parse_quantity_to_kg(quantity)
-    if qty_kg is None:
+    return format_deal_price_kg(parse_quantity_to_kg(quantity), price_per_kg)
+
+
+def format_deal_price_kg(qty_kg: Optional[float], price_per_kg: Optional[float]) -> str:
+    if qty_kg is None or price_per_kg is None:
         return "⚠️ Hisoblab bo'lmadi"
     return f"{format_money_with_commas(qty_kg * price_per_kg)} сум"
 
 
+def order_quantity_kg(data: dict) -> Optional[float]:
+    qty_kg = data.get("quantity_kg")
+    if qty_kg is None:
+        return parse_quantity_to_kg(data["quantity"])
+    return qty_kg
+
+
 def report_period_keyboard() -> InlineKeyboardMarkup:
     today = datetime.now(TASHKENT_TZ)
-    current_month_label = today.strftime("%Y-%m")
-    prev_month = today.replace(day=1) - timedelta(days=1)
-    prev_month_label = prev_month.strftime("%Y-%m")
+    return build_report_period_keyboard(today.year, today.month)
+
+
+@lru_cache(maxsize=4)
+def build_report_period_keyboard(year: int, month: int) -> InlineKeyboardMarkup:
+    current_month_label = f"{year:04d}-{month:02d}"
+    if month == 1:
+        prev_month_label = f"{year - 1:04d}-12"
+    else:
+        prev_month_label = f"{year:04d}-{month - 1:02d}"
     return InlineKeyboardMarkup(
         inline_keyboard=[
             [
@@ -975,11 +1339,11 @@ def report_period_keyboard() -> InlineKeyboardMarkup:
             ],
             [
                 InlineKeyboardButton(
-                    text=f"📅 {today.year} yil",
+                    text=f"📅 {year} yil",
                     callback_data="report_period:current_year",
                 ),
                 InlineKeyboardButton(
-                    text=f"📅 {today.year - 1} yil",
+                    text=f"📅 {year - 1} yil",
                     callback_data="report_period:previous_year",
                 ),
             ],
@@ -988,14 +1352,14 @@ def report_period_keyboard() -> InlineKeyboardMarkup:
 
 
 def get_month_range(reference: datetime, offset: int) -> tuple[datetime, datetime]:
-    year = reference.year
-    month = reference.month + offset
-    while month < 1:
-        month += 12
-        year -= 1
-    while month > 12:
-        month -= 12
-        year += 1
+    return build_month_range(reference.year, reference.month, offset)
+
+
+@lru_cache(maxsize=64)
+def build_month_range(reference_year: int, reference_month: int, offset: int) -> tuple[datetime, datetime]:
+    year_delta, month_index = divmod(reference_month - 1 + offset, 12)
+    year = reference_year + year_delta
+    month = month_index + 1
     start = datetime(year, month, 1)
     if month == 12:
         next_month = datetime(year + 1, 1, 1)
@@ -1005,10 +1369,37 @@ def get_month_range(reference: datetime, offset: int) -> tuple[datetime, datetim
     return start, end
 
 
+@lru_cache(maxsize=16)
 def get_year_range(year: int) -> tuple[datetime, datetime]:
     return datetime(year, 1, 1), datetime(year, 12, 31)
 
 
+REPORT_PERIODS = {
+    "current_month": lambda now: get_month_range(now, 0),
+    "previous_month": lambda now: get_month_range(now, -1),
+    "current_year": lambda now: get_year_range(now.year),
+    "previous_year": lambda now: get_year_range(now.year - 1),
+}
+
+
+def build_report_payload(user_id: int, start_date: datetime, end_date: datetime) -> tuple[str, str]:
+    stats = calculate_report_stats(
+        db.list_orders_for_report(
+            start_date.strftime("%Y-%m-%d"),
+            end_date.strftime("%Y-%m-%d"),
+        )
+    )
+    summary_text = build_report_summary_text(stats, start_date, end_date)
+    fd, file_path = tempfile.mkstemp(suffix=".html", prefix=f"report_{user_id}_")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", buffering=REPORT_WRITE_BUFFER) as handle:
+            handle.writelines(iter_report_html(stats, start_date, end_date))
+    except BaseException:
+        os.remove(file_path)
+        raise
+    return summary_text, file_path
+
+
 async def send_report_for_period(
     bot: Bot,
     chat_id: int,
@@ -1016,19 +1407,11 @@ async def send_report_for_period(
     start_date: datetime,
     end_date: datetime,
 ) -> None:
-    rows = list(
-        db.list_orders_for_report(
-            start_date.strftime("%Y-%m-%d"),
-            end_date.strftime("%Y-%m-%d"),
-        )
+    summary_text, file_path = await asyncio.to_thread(
+        build_report_payload, user_id, start_date, end_date
     )
-    summary_text = build_report_summary_text(rows, start_date, end_date)
     period_label = format_report_period(start_date, end_date)
     timestamp = int(datetime.utcnow().timestamp())
-    file_path = f"report_{user_id}_{timestamp}.html"
-    report_html = build_report_html(rows, start_date, end_date)
-    with open(file_path, "w", encoding="utf-8") as handle:
-        handle.write(report_html)
     try:
         await bot.send_message(
             chat_id,
@@ -1037,7 +1420,7 @@ async def send_report_for_period(
         )
         await bot.send_document(
             chat_id,
-            types.FSInputFile(file_path),
+            types.FSInputFile(file_path, filename=f"report_{user_id}_{timestamp}.html"),
             caption=f"📑 Hisobot tayyor.\nDavr: {period_label}",
             reply_markup=user_keyboard(user_id),
         )
@@ -1046,8 +1429,15 @@ async def send_report_for_period(
             os.remove(file_path)
 
 
-async def send_product(chat_id: int, product, bot: Bot, admin: bool) -> None:
-    photos = db.get_product_photos(product["id"])
+async def send_product(
+    chat_id: int,
+    product,
+    bot: Bot,
+    admin: bool,
+    photos: Optional[list[str]] = None,
+) -> None:
+    if photos is None:
+        photos = db.get_product_photos(product["id"])
     caption = (
         f"📦 Mahsulot: {product['name']}\n"
         f"💰 Narxi (1 kg): {product['price_per_kg']} сум\n"
@@ -1064,10 +1454,10 @@ async def send_product(chat_id: int, product, bot: Bot, admin: bool) -> None:
         if len(remaining_photos) == 1:
             await bot.send_photo(chat_id=chat_id, photo=remaining_photos[0])
         elif len(remaining_photos) > 1:
-            builder = MediaGroupBuilder()
-            for file_id in remaining_photos:
-                builder.add_photo(media=file_id)
-            await bot.send_media_group(chat_id=chat_id, media=builder.build())
+            await bot.send_media_group(
+                chat_id=chat_id,
+                media=[InputMediaPhoto(media=file_id) for file_id in remaining_photos],
+            )
     else:
         await bot.send_message(
             chat_id=chat_id,
@@ -1103,34 +1493,97 @@ def format_support_user_details(
     )
 
 
+async def send_support_to_group(
+    group_id: int,
+    message: types.Message,
+    support_text: str,
+) -> Optional[types.Message]:
+    bot = message.bot
+    if message.photo:
+        return await bot.send_photo(
+            chat_id=group_id,
+            photo=message.photo[-1].file_id,
+            caption=support_text,
+        )
+    if message.video:
+        return await bot.send_video(
+            chat_id=group_id,
+            video=message.video.file_id,
+            caption=support_text,
+        )
+    if message.document:
+        return await bot.send_document(
+            chat_id=group_id,
+            document=message.document.file_id,
+            caption=support_text,
+        )
+    return await bot.send_message(group_id, support_text)
+
+
+SUPPORT_ID_RE = re.compile(r"\bID:\s*(\d+)\b")
+ORDER_ID_RE = re.compile(r"\d+")
+
+
 def parse_support_user_id(text: Optional[str]) -> Optional[int]:
     if not text:
         return None
-    match = re.search(r"\bID:\s*(\d+)\b", text)
+    match = SUPPORT_ID_RE.search(text)
     if not match:
         return None
     return int(match.group(1))
 
 
-async def handle_media_group_timeout(user_id: int, bot: Bot, state: FSMContext) -> None:
-    await asyncio.sleep(1.2)
+def parse_order_id(text: Optional[str]) -> Optional[int]:
+    if not text:
+        return None
+    stripped = text.strip()
+    if stripped.isascii() and stripped.isdigit():
+        return int(stripped)
+    match = ORDER_ID_RE.search(stripped)
+    if not match:
+        return None
+    return int(match.group())
+
+
+def spawn(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+def schedule_media_group_finalize(user_id: int, bot: Bot, state: FSMContext) -> None:
     buffer_entry = media_group_buffer.get(user_id)
-    if not buffer_entry or buffer_entry.get("finalized"):
+    if buffer_entry is None:
+        return
+    timer = buffer_entry.get("timer")
+    if timer:
+        timer.cancel()
+    buffer_entry["timer"] = asyncio.get_running_loop().call_later(
+        MEDIA_GROUP_DELAY,
+        lambda: spawn(finalize_media_group(user_id, bot, state)),
+    )
+
+
+async def finalize_media_group(user_id: int, bot: Bot, state: FSMContext) -> None:
+    buffer_entry = media_group_buffer.pop(user_id)
+    if not buffer_entry:
         return
-    buffer_entry["finalized"] = True
     payload = BroadcastPayload(
         kind="media_group",
         caption=buffer_entry.get("caption"),
         media_items=buffer_entry["media_items"],
     )
-    await state.update_data(broadcast_payload=payload)
+    await state.update_data(broadcast_payload=asdict(payload))
     await bot.send_message(user_id, "📣 Tarqatmani tasdiqlaysizmi? (Ha/Yo'q)")
     await state.set_state(BroadcastStates.confirm)
 
 
 def parse_price(value: str) -> Optional[float]:
+    if "," in value:
+        value = value.replace(",", ".")
     try:
-        return float(value.replace(",", "."))
+        return float(value)
     except ValueError:
         return None
 
@@ -1139,34 +1592,144 @@ def is_admin(user_id: int) -> bool:
     return user_id in ADMIN_LIST
 
 
+def build_broadcast_sender(bot: Bot, payload: BroadcastPayload) -> Callable[[int], Awaitable]:
+    if payload.kind == "text":
+        return lambda chat_id: bot.send_message(chat_id, payload.text or "")
+    if payload.kind in ("photo", "video"):
+        return lambda chat_id: bot.copy_message(
+            chat_id=chat_id,
+            from_chat_id=payload.source_chat_id,
+            message_id=payload.source_message_id,
+        )
+    if payload.kind == "media_group":
+        builder = MediaGroupBuilder(caption=payload.caption)
+        for item in payload.media_items[:10]:
+            if item["type"] == "video":
+                builder.add_video(media=item["file_id"])
+            else:
+                builder.add_photo(media=item["file_id"])
+        media = builder.build()
+        return lambda chat_id: bot.send_media_group(chat_id, media=media)
+    raise ValueError(f"Unknown broadcast kind: {payload.kind}")
+
+
+async def run_broadcast(bot: Bot, payload: BroadcastPayload) -> tuple[int, int]:
+    send = build_broadcast_sender(bot, payload)
+    queue: asyncio.Queue[Optional[int]] = asyncio.Queue(maxsize=BROADCAST_BATCH)
+    success = 0
+    failed = 0
+
+    async def worker() -> None:
+        nonlocal success, failed
+        while (chat_id := await queue.get()) is not None:
+            await broadcast_limiter.wait()
+            try:
+                try:
+                    await send(chat_id)
+                except TelegramRetryAfter as error:
+                    await asyncio.sleep(error.retry_after)
+                    await send(chat_id)
+                success += 1
+            except Exception:
+                failed += 1
+
+    workers = [asyncio.create_task(worker()) for _ in range(BROADCAST_CONCURRENCY)]
+    try:
+        after_id = 0
+        while rows := await asyncio.to_thread(db.list_user_ids_after, after_id, BROADCAST_BATCH):
+            for row in rows:
+                await queue.put(row["tg_id"])
+            after_id = rows[-1]["id"]
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+    return success, failed
+
+
+async def broadcast_and_report(bot: Bot, payload: BroadcastPayload, chat_id: int, admin_id: int) -> None:
+    try:
+        success, failed = await run_broadcast(bot, payload)
+        await bot.send_message(
+            chat_id, f"✅ Tarqatma yakunlandi. Muvaffaqiyatli: {success}, Xatolar: {failed}."
+        )
+    except Exception:
+        logging.exception("Broadcast failed")
+    finally:
+        active_broadcasts.discard(admin_id)
+
+
 def safe_caption(message: types.Message) -> Optional[str]:
     return message.caption if message.caption else None
 
 
-async def reverse_geocode(latitude: float, longitude: float) -> Optional[str]:
-    def _lookup() -> Optional[str]:
-        params = urllib.parse.urlencode(
-            {
-                "format": "json",
-                "lat": latitude,
-                "lon": longitude,
-                "zoom": 18,
-                "addressdetails": 1,
-            }
-        )
-        url = f"https://nominatim.openstreetmap.org/reverse?{params}"
-        request = urllib.request.Request(
-            url,
+GEOCODE_URL = "https://nominatim.openstreetmap.org/reverse"
+geocode_cache = TTLCache(maxsize=4096, ttl=86400)
+_geo_session: Optional[aiohttp.ClientSession] = None
+
+
+def get_geo_session() -> aiohttp.ClientSession:
+    global _geo_session
+    if _geo_session is None or _geo_session.closed:
+        _geo_session = aiohttp.ClientSession(
             headers={"User-Agent": "shrotdef-bot/1.0"},
+            timeout=aiohttp.ClientTimeout(total=10),
         )
-        with urllib.request.urlopen(request, timeout=10) as response:
-            payload = json.loads(response.read().decode("utf-8"))
-        return payload.get("display_name")
+    return _geo_session
+
+
+async def close_geo_session() -> None:
+    if _geo_session is not None and not _geo_session.closed:
+        await _geo_session.close()
+
 
+async def reverse_geocode(latitude: float, longitude: float) -> Optional[str]:
+    cache_key = (round(latitude, 4), round(longitude, 4))
+    cached = geocode_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    params = {
+        "format": "json",
+        "lat": latitude,
+        "lon": longitude,
+        "zoom": 18,
+        "addressdetails": 1,
+    }
     try:
-        return await asyncio.to_thread(_lookup)
+        async with get_geo_session().get(GEOCODE_URL, params=params) as response:
+            payload = await response.json(content_type=None)
     except Exception:
         return None
+    address = payload.get("display_name")
+    if address:
+        geocode_cache[cache_key] = address
+    return address
+
+
+async def run_db_optimize(interval: float = 15 * 60) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(db.prune_support_replies, SUPPORT_REPLY_KEEP_DAYS)
+        except sqlite3.Error:
+            logging.exception("Pruning support reply routes failed")
+        try:
+            await asyncio.to_thread(db.optimize)
+        except sqlite3.Error:
+            logging.exception("PRAGMA optimize failed")
+
+
+def build_fsm_storage() -> BaseStorage:
+    redis_url = os.getenv("REDIS_URL")
+    if not redis_url:
+        return MemoryStorage()
+    from aiogram.fsm.storage.redis import RedisStorage
+    from redis.asyncio import ConnectionPool, Redis
+
+    pool = ConnectionPool.from_url(redis_url, max_connections=REDIS_MAX_CONNECTIONS)
+    return RedisStorage(redis=Redis(connection_pool=pool))
 
 
 async def main() -> None:
@@ -1177,17 +1740,21 @@ async def main() -> None:
         raise RuntimeError("BOT_TOKEN is required")
 
     db.init_db()
+    asyncio.get_running_loop().set_default_executor(io_executor)
 
 
-    bot = Bot(token=token)
-    dp = Dispatcher(storage=MemoryStorage())
+    session = AiohttpSession(limit=BOT_CONNECTION_LIMIT, timeout=BOT_REQUEST_TIMEOUT)
+    bot = Bot(token=token, session=session)
+    dp = Dispatcher(storage=build_fsm_storage())
+    dp.update.outer_middleware(ChatSerialMiddleware(UPDATE_CONCURRENCY))
     dp.message.middleware(BlockedUserMiddleware())
     dp.callback_query.middleware(BlockedUserMiddleware())
     dp.message.middleware(ActivityMiddleware())
 
     @dp.message(CommandStart())
     async def start(message: types.Message) -> None:
-        db.add_or_update_user(
+        await asyncio.to_thread(
+            db.add_or_update_user,
             message.from_user.id,
             message.from_user.first_name,
             message.from_user.last_name,
@@ -1225,23 +1792,22 @@ async def main() -> None:
             if admin:
                 await message.answer(
                     "➕ Mahsulot qo'shish uchun pastdagi tugmani bosing.",
-                    reply_markup=InlineKeyboardMarkup(
-                        inline_keyboard=[
-                            [InlineKeyboardButton(text=BTN_ADD_PRODUCT, callback_data="add_product")]
-                        ]
-                    ),
+                    reply_markup=add_product_inline_keyboard(),
                 )
             return
+        photos_by_product = db.get_product_photos_many([product["id"] for product in products])
         for product in products:
-            await send_product(message.chat.id, product, bot, admin)
+            await send_product(
+                message.chat.id,
+                product,
+                bot,
+                admin,
+                photos=photos_by_product.get(product["id"], []),
+            )
         if admin:
             await message.answer(
                 "➕ Mahsulot qo'shish uchun pastdagi tugmani bosing.",
-                reply_markup=InlineKeyboardMarkup(
-                    inline_keyboard=[
-                        [InlineKeyboardButton(text=BTN_ADD_PRODUCT, callback_data="add_product")]
-                    ]
-                ),
+                reply_markup=add_product_inline_keyboard(),
             )
 
     @dp.callback_query(F.data.startswith("order:"))
@@ -1278,7 +1844,7 @@ async def main() -> None:
             )
             return
         normalized_quantity = f"{format_price(qty_tons)} tonna"
-        await state.update_data(quantity=normalized_quantity)
+        await state.update_data(quantity=normalized_quantity, quantity_kg=round(qty_tons, 2) * 1000)
         await message.answer(
             "📍 Manzilni kiriting yoki lokatsiyani yuboring.",
             reply_markup=order_address_keyboard(),
@@ -1292,7 +1858,7 @@ async def main() -> None:
             await message.answer("❌ Foydalanuvchi topilmadi.")
             await state.clear()
             return
-        product = db.get_product(data["product_id"])
+        product = get_product_cached(data["product_id"])
         if not product:
             await message.answer("❌ Mahsulot topilmadi.")
             await state.clear()
@@ -1310,7 +1876,7 @@ async def main() -> None:
             f"📦 Mahsulot: {escape(product['name'])}",
             f"⚖️ Miqdor: {escape(quantity)}",
             f"💰 Narx (1 kg): {escape(format_price(price_per_kg))} сум",
-            f"💵 Jami: {escape(format_deal_price(quantity, price_per_kg))}",
+            f"💵 Jami: {escape(format_deal_price_kg(order_quantity_kg(data), price_per_kg))}",
             f"📍 Manzil: {escape(address)}",
         ]
         if location_link:
@@ -1330,7 +1896,7 @@ async def main() -> None:
             await message.answer("❌ Foydalanuvchi topilmadi.")
             await state.clear()
             return
-        product = db.get_product(data["product_id"])
+        product = get_product_cached(data["product_id"])
         if not product:
             await message.answer("❌ Mahsulot topilmadi.")
             await state.clear()
@@ -1352,8 +1918,8 @@ async def main() -> None:
         await message.answer(
             "✅ Buyurtma tasdiqlandi!", reply_markup=user_keyboard(message.from_user.id)
         )
-        await notify_admins_new_order(message.bot, order_id)
         await state.clear()
+        spawn(notify_admins_new_order(message.bot, order_id))
 
     @dp.message(OrderStates.address, F.location)
     async def order_address_location(message: types.Message, state: FSMContext) -> None:
@@ -1430,7 +1996,7 @@ async def main() -> None:
             await cancel_admin_action(message, state)
             return
         phone = (message.text or "").strip()
-        normalized_phone = normalize_phone(phone)
+        normalized_phone = db.normalize_phone(phone)
         if not normalized_phone:
             await message.answer("⚠️ Telefon raqamini kiriting.", reply_markup=cancel_keyboard())
             return
@@ -1488,7 +2054,7 @@ async def main() -> None:
             await callback.answer()
             return
         product_id = int(callback.data.split(":", 1)[1])
-        product = db.get_product(product_id)
+        product = get_product_cached(product_id)
         if not product:
             await callback.answer("❌ Mahsulot topilmadi", show_alert=True)
             return
@@ -1514,12 +2080,12 @@ async def main() -> None:
             )
             return
         normalized_quantity = f"{format_price(qty_tons)} tonna"
-        await state.update_data(quantity=normalized_quantity)
+        await state.update_data(quantity=normalized_quantity, quantity_kg=round(qty_tons, 2) * 1000)
         await send_admin_order_confirmation(message, state)
 
     async def send_admin_order_confirmation(message: types.Message, state: FSMContext) -> None:
         data = await state.get_data()
-        product = db.get_product(data["product_id"])
+        product = get_product_cached(data["product_id"])
         if not product:
             await message.answer("❌ Mahsulot topilmadi.")
             await state.clear()
@@ -1532,7 +2098,7 @@ async def main() -> None:
             f"📦 Mahsulot: {escape(product['name'])}",
             f"⚖️ Miqdor: {escape(data['quantity'])}",
             f"💰 Narx (1 kg): {escape(format_price(product['price_per_kg']))} сум",
-            f"💵 Jami: {escape(format_deal_price(data['quantity'], product['price_per_kg']))}",
+            f"💵 Jami: {escape(format_deal_price_kg(order_quantity_kg(data), product['price_per_kg']))}",
             "",
             "Buyurtmani yaratishni tasdiqlaysizmi? Buyurtma «Yopilgan» holatida yaratiladi.",
         ]
@@ -1550,14 +2116,17 @@ async def main() -> None:
             await callback.answer()
             return
         data = await state.get_data()
-        product = db.get_product(data["product_id"])
+        product = get_product_cached(data["product_id"])
         if not product:
             await callback.answer("❌ Mahsulot topilmadi", show_alert=True)
             await state.clear()
             return
+        now = db.now_tashkent().isoformat()
         user_id = data.get("user_id")
         if not user_id:
-            user_id = db.add_manual_user(data["client_name"], data["client_phone"], callback.from_user.id)
+            user_id = db.add_manual_user(
+                data["client_name"], data["client_phone"], callback.from_user.id, now=now
+            )
         order_id = db.add_admin_order(
             user_id,
             product["id"],
@@ -1565,6 +2134,7 @@ async def main() -> None:
             data["address"],
             product["price_per_kg"],
             callback.from_user.id,
+            now=now,
         )
         client_tg_id = data.get("client_tg_id")
         if client_tg_id and client_tg_id > 0:
@@ -1577,7 +2147,7 @@ async def main() -> None:
                 f"📦 Mahsulot: {escape(product['name'])}",
                 f"⚖️ Miqdor: {escape(data['quantity'])}",
                 f"💰 Narx (1 kg): {escape(format_price(product['price_per_kg']))} сум",
-                f"💵 Jami: {escape(format_deal_price(data['quantity'], product['price_per_kg']))}",
+                f"💵 Jami: {escape(format_deal_price_kg(order_quantity_kg(data), product['price_per_kg']))}",
                 "📌 Holat: Yopilgan",
             ]
             try:
@@ -1661,47 +2231,30 @@ async def main() -> None:
             return
         user = db.get_user_by_tg_id(message.from_user.id)
         phone = user["phone"] if user else None
-        full_name = " ".join(
-            part for part in [message.from_user.first_name, message.from_user.last_name] if part
-        )
-        name_display = full_name if full_name else "Noma'lum foydalanuvchi"
         support_text = format_support_user_details(
-            name_display,
+            format_user_name(message.from_user.first_name, message.from_user.last_name),
             phone,
             message.text or message.caption,
         )
+        group_ids = tuple(GROUP_LIST)
+        results = await asyncio.gather(
+            *(send_support_to_group(group_id, message, support_text) for group_id in group_ids),
+            return_exceptions=True,
+        )
         success = 0
-        for group_id in GROUP_LIST:
-            try:
-                sent_message: Optional[types.Message] = None
-                if message.photo:
-                    sent_message = await message.bot.send_photo(
-                        chat_id=group_id,
-                        photo=message.photo[-1].file_id,
-                        caption=support_text,
-                    )
-                elif message.video:
-                    sent_message = await message.bot.send_video(
-                        chat_id=group_id,
-                        video=message.video.file_id,
-                        caption=support_text,
-                    )
-                elif message.document:
-                    sent_message = await message.bot.send_document(
-                        chat_id=group_id,
-                        document=message.document.file_id,
-                        caption=support_text,
-                    )
-                else:
-                    sent_message = await message.bot.send_message(
-                        group_id,
-                        support_text,
-                    )
-                if sent_message:
-                    support_reply_map[(group_id, sent_message.message_id)] = message.from_user.id
-                success += 1
-            except Exception:
+        reply_entries = []
+        for group_id, sent_message in zip(group_ids, results):
+            if isinstance(sent_message, Exception):
                 continue
+            if sent_message:
+                support_reply_map[(group_id, sent_message.message_id)] = message.from_user.id
+                reply_entries.append((group_id, sent_message.message_id, message.from_user.id))
+            success += 1
+        if reply_entries:
+            try:
+                await asyncio.to_thread(db.add_support_replies, reply_entries)
+            except sqlite3.Error:
+                logging.exception("Failed to store support reply routes")
         if not success:
             await message.answer(
                 "⚠️ Xabarni yuborib bo'lmadi. Iltimos, keyinroq urinib ko'ring.",
@@ -1715,7 +2268,36 @@ async def main() -> None:
         )
         await state.clear()
 
-    @dp.message(F.text == BTN_BLOCK_USERS)
+    text_routes: dict[str, Callable[[types.Message, FSMContext], Awaitable[None]]] = {}
+
+    def text_route(button: str):
+        def register(handler):
+            text_routes[button] = handler
+            return handler
+
+        return register
+
+    block_user_flow = {BlockUserStates.action.state, BlockUserStates.phone.state}
+    report_flow = {ReportStates.start_date.state, ReportStates.end_date.state}
+    order_id_flow = {OrderDeleteStates.order_id.state, OrderSearchStates.order_id.state}
+    # Flows whose handlers used to be registered ahead of a button keep
+    # receiving that button's text, as they did before the router.
+    text_route_yields = {
+        BTN_STATS: block_user_flow,
+        BTN_REPORTS: block_user_flow,
+        BTN_ORDERS_LIST: block_user_flow | report_flow,
+        BTN_MY_ORDERS: block_user_flow | report_flow,
+        BTN_ADD_PRODUCT: block_user_flow | report_flow | order_id_flow,
+    }
+
+    def text_route_applies(message: types.Message, raw_state: Optional[str]) -> bool:
+        return raw_state not in text_route_yields.get(message.text, ())
+
+    @dp.message(F.text.in_(text_routes), text_route_applies)
+    async def route_text_button(message: types.Message, state: FSMContext) -> None:
+        await text_routes[message.text](message, state)
+
+    @text_route(BTN_BLOCK_USERS)
     async def block_users_menu(message: types.Message, state: FSMContext) -> None:
         if not is_admin(message.from_user.id):
             return
@@ -1731,7 +2313,7 @@ async def main() -> None:
             await cancel_admin_action(message, state)
             return
         action_text = (message.text or "").strip()
-        if action_text not in {BTN_BLOCK, BTN_UNBLOCK}:
+        if action_text not in BLOCK_ACTIONS:
             await message.answer(
                 "⚠️ Iltimos, bloklash yoki blokdan chiqarishni tanlang.",
                 reply_markup=block_action_keyboard(),
@@ -1775,6 +2357,7 @@ async def main() -> None:
                 )
             else:
                 db.set_user_blocked(user["tg_id"], True)
+                _block_cache.pop(user["tg_id"], None)
                 await message.answer(
                     f"✅ Foydalanuvchi bloklandi: {name_display}.",
                     reply_markup=user_keyboard(message.from_user.id),
@@ -1787,20 +2370,20 @@ async def main() -> None:
                 )
             else:
                 db.set_user_blocked(user["tg_id"], False)
+                _block_cache.pop(user["tg_id"], None)
                 await message.answer(
                     f"✅ Foydalanuvchi blokdan chiqarildi: {name_display}.",
                     reply_markup=user_keyboard(message.from_user.id),
                 )
         await state.clear()
 
-    @dp.message(F.text == BTN_STATS)
-    async def show_stats(message: types.Message) -> None:
+    @text_route(BTN_STATS)
+    async def show_stats(message: types.Message, state: FSMContext) -> None:
         if not is_admin(message.from_user.id):
             return
-        total = db.count_users()
-        active = db.count_active_users(30)
-        top_purchasers = db.list_top_purchasers()
-        top_active_users = db.list_top_active_users()
+        total, active, top_purchasers, top_active_users = await asyncio.to_thread(
+            db.get_user_stats, 30
+        )
         purchaser_lines = []
         for idx, row in enumerate(top_purchasers, start=1):
             contact = format_user_contact(row["first_name"], row["last_name"], row["phone"])
@@ -1812,16 +2395,10 @@ async def main() -> None:
         purchasers_text = "\n".join(purchaser_lines) if purchaser_lines else "Hozircha ma'lumot yo'q."
         active_users_text = "\n".join(active_lines) if active_lines else "Hozircha ma'lumot yo'q."
         await message.answer(
-            "📊 Statistika:\n"
-            f"👥 Umumiy foydalanuvchilar: {total}\n"
-            f"🔥 So'nggi 30 kunda faol: {active}\n\n"
-            "🏆 Ko'p marta buyurtma bergan foydalanuvchilar:\n"
-            f"{purchasers_text}\n\n"
-            "🚀 Botdan ko'p foydalanadigan foydalanuvchilar:\n"
-            f"{active_users_text}"
+            STATS_MESSAGE_TEMPLATE % (total, active, purchasers_text, active_users_text)
         )
 
-    @dp.message(F.text == BTN_REPORTS)
+    @text_route(BTN_REPORTS)
     async def report_start(message: types.Message, state: FSMContext) -> None:
         if not can_view_reports(message.from_user.id):
             return
@@ -1842,18 +2419,11 @@ async def main() -> None:
             await callback.answer()
             return
         period_key = callback.data.split(":", 1)[1]
-        now = datetime.now()
-        if period_key == "current_month":
-            start_date, end_date = get_month_range(now, 0)
-        elif period_key == "previous_month":
-            start_date, end_date = get_month_range(now, -1)
-        elif period_key == "current_year":
-            start_date, end_date = get_year_range(now.year)
-        elif period_key == "previous_year":
-            start_date, end_date = get_year_range(now.year - 1)
-        else:
+        period_range = REPORT_PERIODS.get(period_key)
+        if period_range is None:
             await callback.answer("⚠️ Davr topilmadi.", show_alert=True)
             return
+        start_date, end_date = period_range(datetime.now())
         await state.clear()
         if callback.message:
             await send_report_for_period(
@@ -1913,32 +2483,23 @@ async def main() -> None:
         )
         await state.clear()
 
-    @dp.message(F.text == BTN_ORDERS_LIST)
-    async def show_orders_summary(message: types.Message) -> None:
+    @text_route(BTN_ORDERS_LIST)
+    async def show_orders_summary(message: types.Message, state: FSMContext) -> None:
         if not is_admin(message.from_user.id):
             return
-        total = db.count_orders()
-        open_count = db.count_orders_by_status("open")
-        closed_count = db.count_orders_by_status("closed")
-        canceled_count = db.count_orders_by_status("canceled")
+        total, open_count, closed_count, canceled_count = await asyncio.to_thread(
+            db.get_order_stats
+        )
         await message.answer(
-            "🧾 Zayavkalar bo'yicha ma'lumot:\n"
-            f"📦 Umumiy: {total}\n"
-            f"✅ Yopilgan: {closed_count}\n"
-            f"❌ Bekor qilingan: {canceled_count}\n"
-            f"🟢 Ochiq: {open_count}",
+            ORDERS_SUMMARY_TEMPLATE % (total, closed_count, canceled_count, open_count),
             reply_markup=orders_status_keyboard(),
         )
 
-    @dp.message(F.text == BTN_MY_ORDERS)
-    async def show_user_orders(message: types.Message) -> None:
+    @text_route(BTN_MY_ORDERS)
+    async def show_user_orders(message: types.Message, state: FSMContext) -> None:
         if not await ensure_user_registered(message):
             return
-        user = db.get_user_by_tg_id(message.from_user.id)
-        if not user:
-            await message.answer("❌ Foydalanuvchi topilmadi.")
-            return
-        orders = db.list_orders_for_user(user["id"])
+        orders = await asyncio.to_thread(db.list_orders_for_tg_id, message.from_user.id)
         if not orders:
             await message.answer("📭 Sizda buyurtmalar mavjud emas.")
             return
@@ -1964,13 +2525,10 @@ async def main() -> None:
     @dp.callback_query(F.data.startswith("user_orders:cancel_confirm:"))
     async def confirm_user_cancel_order(callback: types.CallbackQuery) -> None:
         order_id = int(callback.data.split(":", 3)[2])
-        user = db.get_user_by_tg_id(callback.from_user.id)
-        if not user:
-            await callback.answer("❌ Foydalanuvchi topilmadi.", show_alert=True)
-            return
-        updated, status, canceled_by_role = db.cancel_order_by_user(
+        updated, status, canceled_by_role = await asyncio.to_thread(
+            db.cancel_order_by_tg_id,
             order_id,
-            user["id"],
+            callback.from_user.id,
         )
         if not updated:
             if status == "closed":
@@ -2006,7 +2564,7 @@ async def main() -> None:
         if not is_admin(callback.from_user.id):
             await callback.answer()
             return
-        orders = db.list_orders_with_details(status="open")
+        orders = await asyncio.to_thread(db.list_orders_with_details, status="open")
         if not orders:
             await callback.message.answer("📭 Hozircha ochiq zayavkalar yo'q.")
             await callback.answer()
@@ -2048,16 +2606,14 @@ async def main() -> None:
             await state.clear()
             await message.answer("❌ O'chirish bekor qilindi.", reply_markup=user_keyboard(message.from_user.id))
             return
-        search_text = message.text or ""
-        match = re.search(r"\d+", search_text)
-        if not match:
+        order_id = parse_order_id(message.text)
+        if order_id is None:
             await message.answer(
                 "⚠️ Iltimos, buyurtma ID raqamini kiriting.",
                 reply_markup=cancel_keyboard(),
             )
             return
-        order_id = int(match.group())
-        order = db.get_order_with_details(order_id)
+        order = await asyncio.to_thread(db.get_order_with_details, order_id)
         if not order:
             await message.answer(
                 "🔎 Buyurtma topilmadi. Qayta urinib ko'ring.",
@@ -2087,7 +2643,7 @@ async def main() -> None:
             await state.clear()
             await callback.answer("⚠️ Buyurtma topilmadi.", show_alert=True)
             return
-        removed = db.delete_order(order_id)
+        removed = await asyncio.to_thread(db.delete_order, order_id)
         await state.clear()
         if not removed:
             await callback.answer("🔎 Buyurtma topilmadi.", show_alert=True)
@@ -2120,16 +2676,14 @@ async def main() -> None:
             await state.clear()
             await message.answer("❌ Qidiruv bekor qilindi.", reply_markup=user_keyboard(message.from_user.id))
             return
-        search_text = message.text or ""
-        match = re.search(r"\d+", search_text)
-        if not match:
+        order_id = parse_order_id(message.text)
+        if order_id is None:
             await message.answer(
                 "⚠️ Iltimos, buyurtma ID raqamini kiriting.",
                 reply_markup=cancel_keyboard(),
             )
             return
-        order_id = int(match.group())
-        order = db.get_order_with_details(order_id)
+        order = await asyncio.to_thread(db.get_order_with_details, order_id)
         if not order:
             await message.answer(
                 "🔎 Buyurtma topilmadi.",
@@ -2153,8 +2707,8 @@ async def main() -> None:
             await callback.answer()
             return
         order_id = int(callback.data.split(":", 2)[2])
-        updated, status, closed_by, canceled_by_role = db.update_order_status(
-            order_id, "closed", callback.from_user.id
+        updated, status, closed_by, canceled_by_role = await asyncio.to_thread(
+            db.update_order_status, order_id, "closed", callback.from_user.id
         )
         if not updated:
             if status == "canceled":
@@ -2191,8 +2745,8 @@ async def main() -> None:
             await callback.answer()
             return
         order_id = int(callback.data.split(":", 3)[2])
-        updated, status, closed_by, canceled_by_role = db.update_order_status(
-            order_id, "canceled", callback.from_user.id
+        updated, status, closed_by, canceled_by_role = await asyncio.to_thread(
+            db.update_order_status, order_id, "canceled", callback.from_user.id
         )
         if not updated:
             if status == "closed":
@@ -2223,9 +2777,13 @@ async def main() -> None:
         if not is_admin(callback.from_user.id):
             await callback.answer()
             return
-        offset = int(callback.data.split(":", 2)[2])
+        parts = callback.data.split(":")
+        offset = int(parts[2])
+        snapshot_total = int(parts[3]) if len(parts) > 3 else None
         limit = 10
-        orders = db.list_orders_with_details(status="closed", limit=limit, offset=offset)
+        orders, total_closed = await asyncio.to_thread(
+            db.list_orders_with_details_and_total, "closed", limit, offset, snapshot_total
+        )
         if not orders:
             if offset == 0:
                 await callback.message.answer("📭 Yopilgan zayavkalar yo'q.")
@@ -2233,24 +2791,18 @@ async def main() -> None:
                 await callback.message.answer("📭 Boshqa yopilgan zayavkalar yo'q.")
             await callback.answer()
             return
-        lines = []
-        for idx, order in enumerate(orders, start=offset + 1):
-            lines.append(
-                "\n".join(
-                    [
-                        f"{idx}. {format_order_message(order, include_id=True, include_address=True)}"
-                    ]
-                )
-            )
-        message_text = "\n\n".join(lines)
-        total_closed = db.count_orders_by_status("closed")
+        message_text = "\n\n".join(
+            f"{idx}. {format_order_message(order, include_id=True, include_address=True)}"
+            for idx, order in enumerate(orders, start=offset + 1)
+        )
         keyboard = None
         if offset + limit < total_closed:
             keyboard = InlineKeyboardMarkup(
                 inline_keyboard=[
                     [
                         InlineKeyboardButton(
-                            text="➡️ Yana 10 ta", callback_data=f"orders:closed:{offset + limit}"
+                            text="➡️ Yana 10 ta",
+                            callback_data=f"orders:closed:{offset + limit}:{total_closed}",
                         )
                     ]
                 ]
@@ -2263,9 +2815,13 @@ async def main() -> None:
         if not is_admin(callback.from_user.id):
             await callback.answer()
             return
-        offset = int(callback.data.split(":", 2)[2])
+        parts = callback.data.split(":")
+        offset = int(parts[2])
+        snapshot_total = int(parts[3]) if len(parts) > 3 else None
         limit = 10
-        orders = db.list_orders_with_details(status="canceled", limit=limit, offset=offset)
+        orders, total_canceled = await asyncio.to_thread(
+            db.list_orders_with_details_and_total, "canceled", limit, offset, snapshot_total
+        )
         if not orders:
             if offset == 0:
                 await callback.message.answer("📭 Bekor qilingan zayavkalar yo'q.")
@@ -2273,24 +2829,18 @@ async def main() -> None:
                 await callback.message.answer("📭 Boshqa bekor qilingan zayavkalar yo'q.")
             await callback.answer()
             return
-        lines = []
-        for idx, order in enumerate(orders, start=offset + 1):
-            lines.append(
-                "\n".join(
-                    [
-                        f"{idx}. {format_order_message(order, include_id=True, include_address=True)}"
-                    ]
-                )
-            )
-        message_text = "\n\n".join(lines)
-        total_canceled = db.count_orders_by_status("canceled")
+        message_text = "\n\n".join(
+            f"{idx}. {format_order_message(order, include_id=True, include_address=True)}"
+            for idx, order in enumerate(orders, start=offset + 1)
+        )
         keyboard = None
         if offset + limit < total_canceled:
             keyboard = InlineKeyboardMarkup(
                 inline_keyboard=[
                     [
                         InlineKeyboardButton(
-                            text="➡️ Yana 10 ta", callback_data=f"orders:canceled:{offset + limit}"
+                            text="➡️ Yana 10 ta",
+                            callback_data=f"orders:canceled:{offset + limit}:{total_canceled}",
                         )
                     ]
                 ]
@@ -2298,7 +2848,7 @@ async def main() -> None:
         await callback.message.answer(message_text, reply_markup=keyboard, parse_mode="HTML")
         await callback.answer()
 
-    @dp.message(F.text == BTN_ADD_PRODUCT)
+    @text_route(BTN_ADD_PRODUCT)
     async def add_product_start(message: types.Message, state: FSMContext) -> None:
         if not is_admin(message.from_user.id):
             return
@@ -2356,15 +2906,12 @@ async def main() -> None:
 
     @dp.message(AddProductStates.photos)
     async def add_product_photos(message: types.Message, state: FSMContext) -> None:
-        data = await state.get_data()
-        photos = data.get("photos", [])
         if is_cancel_message(message):
             await cancel_admin_action(message, state)
             return
+        data = await state.get_data()
         if message.text and message.text.strip() == BTN_SKIP_PHOTOS:
-            product_id = db.add_product(data["name"], data["price"], data["description"])
-            if photos:
-                db.set_product_photos(product_id, photos[:1])
+            db.add_product(data["name"], data["price"], data["description"])
             await message.answer("✅ Mahsulot qo'shildi.", reply_markup=user_keyboard(message.from_user.id))
             await state.clear()
             return
@@ -2374,10 +2921,8 @@ async def main() -> None:
                 reply_markup=add_product_photos_keyboard(),
             )
             return
-        photos = [message.photo[-1].file_id]
-        await state.update_data(photos=photos[:1])
         product_id = db.add_product(data["name"], data["price"], data["description"])
-        db.set_product_photos(product_id, photos[:1])
+        db.set_product_photos(product_id, [message.photo[-1].file_id])
         await message.answer("✅ Mahsulot qo'shildi.", reply_markup=user_keyboard(message.from_user.id))
         await state.clear()
 
@@ -2395,10 +2940,11 @@ async def main() -> None:
                 reply_markup=edit_inline_keyboard(product["id"]),
             )
 
-    @dp.callback_query(F.data.startswith("edit:"))
-    async def edit_product_start(callback: types.CallbackQuery, state: FSMContext) -> None:
-        product_id = int(callback.data.split(":", 1)[1])
-        await state.update_data(product_id=product_id)
+    @dp.callback_query(EditProductCallback.filter())
+    async def edit_product_start(
+        callback: types.CallbackQuery, callback_data: EditProductCallback, state: FSMContext
+    ) -> None:
+        await state.update_data(product_id=callback_data.product_id)
         await callback.message.answer("✏️ Nimani tahrirlaysiz?", reply_markup=edit_fields_keyboard())
         await callback.message.answer(
             "❌ Agar bekor qilmoqchi bo'lsangiz, Bekor qilish tugmasini bosing.",
@@ -2412,9 +2958,11 @@ async def main() -> None:
         if is_cancel_message(message):
             await cancel_admin_action(message, state)
 
-    @dp.callback_query(EditProductStates.field, F.data.startswith("field:"))
-    async def edit_product_field(callback: types.CallbackQuery, state: FSMContext) -> None:
-        field = callback.data.split(":", 1)[1]
+    @dp.callback_query(EditProductStates.field, EditFieldCallback.filter())
+    async def edit_product_field(
+        callback: types.CallbackQuery, callback_data: EditFieldCallback, state: FSMContext
+    ) -> None:
+        field = callback_data.name
         if field == "delete":
             data = await state.get_data()
             product_id = data["product_id"]
@@ -2438,10 +2986,10 @@ async def main() -> None:
 
     @dp.message(EditProductStates.value)
     async def edit_product_value(message: types.Message, state: FSMContext) -> None:
-        data = await state.get_data()
         if is_cancel_message(message):
             await cancel_admin_action(message, state)
             return
+        data = await state.get_data()
         product_id = data["product_id"]
         field = data["field"]
         if field == "name":
@@ -2454,21 +3002,18 @@ async def main() -> None:
             db.update_product_price(product_id, price)
         elif field == "description":
             db.update_product_description(product_id, message.text)
+        product_cache.pop(product_id)
         await message.answer("✅ Mahsulot yangilandi.", reply_markup=user_keyboard(message.from_user.id))
         await state.clear()
 
     @dp.message(EditProductStates.photos)
     async def edit_product_photos(message: types.Message, state: FSMContext) -> None:
-        data = await state.get_data()
-        photos = data.get("photos", [])
         if is_cancel_message(message):
             await cancel_admin_action(message, state)
             return
+        data = await state.get_data()
         if message.text and message.text.strip() == BTN_SKIP_PHOTOS:
-            if photos:
-                db.set_product_photos(data["product_id"], photos[:1])
-            else:
-                db.set_product_photos(data["product_id"], [])
+            db.set_product_photos(data["product_id"], [])
             await message.answer("✅ Rasmlar yangilandi.", reply_markup=user_keyboard(message.from_user.id))
             await state.clear()
             return
@@ -2478,21 +3023,20 @@ async def main() -> None:
                 reply_markup=add_product_photos_keyboard(),
             )
             return
-        photos = [message.photo[-1].file_id]
-        await state.update_data(photos=photos[:1])
-        db.set_product_photos(data["product_id"], photos[:1])
+        db.set_product_photos(data["product_id"], [message.photo[-1].file_id])
         await message.answer("✅ Rasmlar yangilandi.", reply_markup=user_keyboard(message.from_user.id))
         await state.clear()
 
-    @dp.callback_query(F.data.startswith("product_delete:confirm:"))
+    @dp.callback_query(ProductDeleteCallback.filter(F.action == "confirm"))
     async def confirm_product_delete(
-        callback: types.CallbackQuery, state: FSMContext
+        callback: types.CallbackQuery, callback_data: ProductDeleteCallback, state: FSMContext
     ) -> None:
         if not is_admin(callback.from_user.id):
             await callback.answer()
             return
-        product_id = int(callback.data.split(":", 2)[2])
+        product_id = callback_data.product_id
         removed = db.delete_product(product_id)
+        product_cache.pop(product_id)
         if not removed:
             await callback.answer("🔎 Mahsulot topilmadi.", show_alert=True)
             return
@@ -2500,15 +3044,14 @@ async def main() -> None:
         await callback.message.answer("🗑 Mahsulot o'chirildi.", reply_markup=user_keyboard(callback.from_user.id))
         await callback.answer()
 
-    @dp.callback_query(F.data.startswith("product_delete:cancel:"))
+    @dp.callback_query(ProductDeleteCallback.filter(F.action == "cancel"))
     async def cancel_product_delete(
-        callback: types.CallbackQuery, state: FSMContext
+        callback: types.CallbackQuery, callback_data: ProductDeleteCallback, state: FSMContext
     ) -> None:
         if not is_admin(callback.from_user.id):
             await callback.answer()
             return
-        product_id = int(callback.data.split(":", 2)[2])
-        await state.update_data(product_id=product_id)
+        await state.update_data(product_id=callback_data.product_id)
         await state.set_state(EditProductStates.field)
         await callback.message.answer("✏️ Nimani tahrirlaysiz?", reply_markup=edit_fields_keyboard())
         await callback.answer("↩️ O'chirish bekor qilindi")
@@ -2525,7 +3068,7 @@ async def main() -> None:
         if message.media_group_id:
             buffer_entry = media_group_buffer.setdefault(
                 message.from_user.id,
-                {"media_items": [], "caption": None, "finalized": False},
+                {"media_items": [], "caption": None},
             )
             if message.photo:
                 buffer_entry["media_items"].append(
@@ -2537,28 +3080,20 @@ async def main() -> None:
                 )
             if not buffer_entry.get("caption") and safe_caption(message):
                 buffer_entry["caption"] = safe_caption(message)
-            if not buffer_entry.get("timer"):
-                buffer_entry["timer"] = asyncio.create_task(
-                    handle_media_group_timeout(message.from_user.id, message.bot, state)
-                )
+            schedule_media_group_finalize(message.from_user.id, message.bot, state)
             return
 
-        if message.photo:
+        if message.photo or message.video:
             payload = BroadcastPayload(
-                kind="photo",
-                file_ids=[message.photo[-1].file_id],
-                caption=safe_caption(message),
-            )
-        elif message.video:
-            payload = BroadcastPayload(
-                kind="video",
-                file_ids=[message.video.file_id],
+                kind="photo" if message.photo else "video",
                 caption=safe_caption(message),
+                source_chat_id=message.chat.id,
+                source_message_id=message.message_id,
             )
         else:
             payload = BroadcastPayload(kind="text", text=message.text)
 
-        await state.update_data(broadcast_payload=payload)
+        await state.update_data(broadcast_payload=asdict(payload))
         await message.answer("📣 Tarqatmani tasdiqlaysizmi? (Ha/Yo'q)")
         await state.set_state(BroadcastStates.confirm)
 
@@ -2573,38 +3108,16 @@ async def main() -> None:
             await state.clear()
             return
 
+        if message.from_user.id in active_broadcasts:
+            await message.answer("⏳ Oldingi tarqatma hali davom etmoqda.")
+            await state.clear()
+            return
         data = await state.get_data()
-        payload: BroadcastPayload = data["broadcast_payload"]
-        users = db.list_users()
-        success = 0
-        failed = 0
-        for user in users:
-            try:
-                if payload.kind == "text":
-                    await bot.send_message(user["tg_id"], payload.text or "")
-                elif payload.kind == "photo":
-                    await bot.send_photo(
-                        user["tg_id"], payload.file_ids[0], caption=payload.caption
-                    )
-                elif payload.kind == "video":
-                    await bot.send_video(
-                        user["tg_id"], payload.file_ids[0], caption=payload.caption
-                    )
-                elif payload.kind == "media_group":
-                    builder = MediaGroupBuilder(caption=payload.caption)
-                    for item in payload.media_items[:10]:
-                        if item["type"] == "video":
-                            builder.add_video(media=item["file_id"])
-                        else:
-                            builder.add_photo(media=item["file_id"])
-                    await bot.send_media_group(user["tg_id"], media=builder.build())
-                success += 1
-            except Exception:
-                failed += 1
-        await message.answer(
-            f"✅ Tarqatma yakunlandi. Muvaffaqiyatli: {success}, Xatolar: {failed}."
-        )
+        payload = BroadcastPayload(**data["broadcast_payload"])
         await state.clear()
+        active_broadcasts.add(message.from_user.id)
+        spawn(broadcast_and_report(bot, payload, message.chat.id, message.from_user.id))
+        await message.answer("📣 Tarqatma boshlandi.")
 
     @dp.message(F.reply_to_message)
     async def support_admin_reply(message: types.Message) -> None:
@@ -2623,6 +3136,10 @@ async def main() -> None:
         if not reply_to:
             return
         user_id = support_reply_map.get((message.chat.id, reply_to.message_id))
+        if not user_id:
+            user_id = await asyncio.to_thread(
+                db.get_support_reply_user, message.chat.id, reply_to.message_id
+            )
         if not user_id:
             user_id = parse_support_user_id(reply_to.text)
         if not user_id:
@@ -2640,7 +3157,17 @@ async def main() -> None:
             return
         await message.answer("👉 Iltimos, menyudan tanlang.")
 
-    await dp.start_polling(bot)
+    optimize_task = asyncio.create_task(run_db_optimize())
+    activity_task = asyncio.create_task(run_activity_flush())
+    try:
+        await dp.start_polling(bot)
+    finally:
+        optimize_task.cancel()
+        activity_task.cancel()
+        await flush_activity()
+        await asyncio.to_thread(db.optimize)
+        io_executor.shutdown(wait=False)
+        await close_geo_session()
 
 
 if __name__ == "__main__":
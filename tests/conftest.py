@@ -0,0 +1,21 @@
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import db  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    path = tmp_path / "bot.sqlite3"
+    monkeypatch.setattr(db, "DB_PATH", str(path))
+    monkeypatch.setattr(db, "_local", threading.local())
+    monkeypatch.setattr(db, "_initialized", False)
+    yield path
+    conn = getattr(db._local, "conn", None)
+    if conn is not None:
+        conn.close()
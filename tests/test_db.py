@@ -0,0 +1,223 @@
+import sqlite3
+
+import db
+
+LEGACY_SCHEMA = """
+    CREATE TABLE users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tg_id INTEGER UNIQUE NOT NULL,
+        first_name TEXT,
+        last_name TEXT,
+        phone TEXT,
+        created_at TEXT NOT NULL,
+        last_active TEXT NOT NULL,
+        activity_count INTEGER NOT NULL DEFAULT 0,
+        is_blocked INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        price_per_kg REAL NOT NULL,
+        description TEXT,
+        is_deleted INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE product_photos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id INTEGER NOT NULL,
+        file_id TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        FOREIGN KEY(product_id) REFERENCES products(id) ON DELETE CASCADE
+    );
+    CREATE TABLE orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity TEXT NOT NULL,
+        address TEXT NOT NULL,
+        latitude REAL,
+        longitude REAL,
+        created_at TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'open',
+        order_price_per_kg REAL,
+        closed_at TEXT,
+        closed_by INTEGER,
+        canceled_by_role TEXT,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
+        FOREIGN KEY(product_id) REFERENCES products(id) ON DELETE CASCADE
+    );
+    INSERT INTO users (tg_id, first_name, phone, created_at, last_active, activity_count)
+    VALUES
+        (101, 'Ali', '+998 90 123-45-67', '2025-01-10T09:00:00+05:00', '2025-02-01T10:00:00+05:00', 4),
+        (102, 'Vali', NULL, '2025-01-11T09:00:00+05:00', '2025-01-11T09:00:00+05:00', 1);
+    INSERT INTO products (name, price_per_kg, is_deleted)
+    VALUES ('Shrot', 4500, 0), ('Old', 3000, 1);
+    INSERT INTO product_photos (product_id, file_id, position)
+    VALUES (1, 'keep', 0), (2, 'gone-a', 0), (2, 'gone-b', 1);
+    INSERT INTO orders (user_id, product_id, quantity, address, created_at, status, order_price_per_kg, closed_at, closed_by)
+    VALUES
+        (1, 1, '2 tonna', 'A', '2025-01-12T10:00:00+05:00', 'open', NULL, NULL, NULL),
+        (1, 1, '1 tonna', 'B', '2025-01-13T10:00:00+05:00', 'closed', 4500, '2025-01-14T10:00:00+05:00', 7),
+        (1, 1, '3 tonna', 'C', '2025-01-15T10:00:00+05:00', 'closed', 4500, NULL, 7),
+        (2, 1, '1 tonna', 'D', '2025-01-16T10:00:00+05:00', 'canceled', 4500, '2025-01-16T11:00:00+05:00', NULL);
+"""
+
+
+def create_legacy_db(path) -> None:
+    conn = sqlite3.connect(path)
+    conn.executescript(LEGACY_SCHEMA)
+    conn.close()
+
+
+def add_user(tg_id: int) -> int:
+    db.add_or_update_user(tg_id, f"user{tg_id}", None)
+    return db.get_user_by_tg_id(tg_id)["id"]
+
+
+def test_init_db_migrates_legacy_database(db_path):
+    create_legacy_db(db_path)
+
+    db.init_db()
+
+    conn = db.get_connection()
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == db.SCHEMA_VERSION
+    assert db.count_orders() == 4
+    assert db.count_users() == 2
+
+    orders = {row["id"]: row for row in conn.execute("SELECT * FROM orders")}
+    assert orders[1]["order_price_per_kg"] == 4500
+    assert orders[3]["closed_at"] == orders[3]["created_at"]
+    assert orders[4]["canceled_by_role"] == "user"
+    for order in orders.values():
+        assert order["created_at_ts"] == db.to_epoch(order["created_at"])
+        if order["closed_at"] is not None:
+            assert order["closed_at_ts"] == db.to_epoch(order["closed_at"])
+        else:
+            assert order["closed_at_ts"] is None
+
+    ali = db.get_user_by_tg_id(101)
+    assert ali["closed_order_count"] == 2
+    assert ali["normalized_phone"] == "901234567"
+    assert ali["last_active_ts"] == db.to_epoch("2025-02-01T10:00:00+05:00")
+    assert db.get_user_by_tg_id(102)["closed_order_count"] == 0
+
+    assert db.get_product_photos(1) == ["keep"]
+    assert db.get_product_photos(2) == []
+
+
+def test_init_db_is_idempotent(db_path):
+    create_legacy_db(db_path)
+    db.init_db()
+    db.init_db()
+
+    assert db.count_orders() == 4
+    assert db.count_users() == 2
+    assert db.get_user_by_tg_id(101)["closed_order_count"] == 2
+
+
+def test_fresh_database_has_final_indexes(db_path):
+    db.init_db()
+
+    names = {
+        row["name"]
+        for row in db.get_connection().execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'"
+        )
+    }
+    assert {"idx_orders_status_closedts", "idx_users_last_active_ts"} <= names
+
+
+def test_stats_triggers_track_inserts_and_deletes(db_path):
+    db.init_db()
+    user_id = add_user(1)
+    add_user(2)
+    product_id = db.add_product("Shrot", 4500, None)
+    first = db.add_order(user_id, product_id, "1 tonna", "A", 4500)
+    db.add_order(user_id, product_id, "2 tonna", "B", 4500)
+
+    assert db.count_users() == 2
+    assert db.count_orders() == 2
+
+    assert db.delete_order(first) is True
+    assert db.count_orders() == 1
+
+
+def test_closed_order_count_triggers(db_path):
+    db.init_db()
+    user_id = add_user(1)
+    product_id = db.add_product("Shrot", 4500, None)
+    first = db.add_order(user_id, product_id, "1 tonna", "A", 4500)
+    second = db.add_order(user_id, product_id, "2 tonna", "B", 4500)
+
+    def closed_count() -> int:
+        return db.get_user_by_tg_id(1)["closed_order_count"]
+
+    db.update_order_status(first, "closed", admin_id=7)
+    db.update_order_status(second, "closed", admin_id=7)
+    assert closed_count() == 2
+
+    with db.get_connection() as conn:
+        conn.execute("UPDATE orders SET status = 'open' WHERE id = ?", (second,))
+    assert closed_count() == 1
+
+    db.delete_order(first)
+    assert closed_count() == 0
+
+
+def test_update_order_status_only_changes_open_orders(db_path):
+    db.init_db()
+    user_id = add_user(1)
+    product_id = db.add_product("Shrot", 4500, None)
+    order_id = db.add_order(user_id, product_id, "1 tonna", "A", 4500)
+
+    assert db.update_order_status(order_id, "closed", admin_id=7) == (True, "closed", 7, None)
+    assert db.update_order_status(order_id, "canceled", admin_id=8) == (False, "closed", 7, None)
+    assert db.update_order_status(999, "closed", admin_id=7) == (False, None, None, None)
+
+
+def test_cancel_order_by_tg_id(db_path):
+    db.init_db()
+    user_id = add_user(1)
+    add_user(2)
+    product_id = db.add_product("Shrot", 4500, None)
+    order_id = db.add_order(user_id, product_id, "1 tonna", "A", 4500)
+    now = "2025-03-01T12:00:00+05:00"
+
+    assert db.cancel_order_by_tg_id(order_id, 2, now=now) == (False, None, None)
+    assert db.cancel_order_by_tg_id(order_id, 1, now=now) == (True, "canceled", "user")
+    assert db.cancel_order_by_tg_id(order_id, 1, now=now) == (False, "canceled", "user")
+
+    row = db.get_connection().execute(
+        "SELECT closed_at, closed_at_ts FROM orders WHERE id = ?", (order_id,)
+    ).fetchone()
+    assert row["closed_at"] == now
+    assert row["closed_at_ts"] == db.to_epoch(now)
+
+
+def test_cancel_order_by_tg_id_defaults_to_tashkent_time(db_path):
+    db.init_db()
+    user_id = add_user(1)
+    product_id = db.add_product("Shrot", 4500, None)
+    order_id = db.add_order(user_id, product_id, "1 tonna", "A", 4500)
+
+    db.cancel_order_by_tg_id(order_id, 1)
+
+    closed_at = db.get_connection().execute(
+        "SELECT closed_at FROM orders WHERE id = ?", (order_id,)
+    ).fetchone()["closed_at"]
+    assert closed_at.endswith("+05:00")
+
+
+def test_activity_updates_do_not_create_users(db_path):
+    db.init_db()
+    add_user(1)
+    now = "2025-03-01T12:00:00+05:00"
+
+    db.update_last_active_many([(1, now, 3), (2, now, 5)])
+
+    user = db.get_user_by_tg_id(1)
+    assert user["activity_count"] == 3
+    assert user["last_active_ts"] == db.to_epoch(now)
+    assert db.get_user_by_tg_id(2) is None
+
+    db.add_or_update_user(1, "Renamed", None)
+    assert db.get_user_by_tg_id(1)["activity_count"] == 3
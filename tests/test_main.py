@@ -0,0 +1,111 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_ttl_cache_expires_entries(clock):
+    cache = main.TTLCache(maxsize=10, ttl=30)
+    cache["a"] = 1
+
+    assert cache.get("a") == 1
+    assert "a" in cache
+
+    clock[0] += 30
+    assert cache.get("a") is None
+    assert "a" not in cache
+
+
+def test_ttl_cache_evicts_oldest_past_maxsize(clock):
+    cache = main.TTLCache(maxsize=2, ttl=30)
+    cache["a"] = 1
+    cache["b"] = 2
+    cache["a"] = 3
+    cache["c"] = 4
+
+    assert cache.get("a") == 3
+    assert cache.get("b") is None
+    assert cache.get("c") == 4
+
+
+def test_ttl_cache_setdefault_and_pop(clock):
+    cache = main.TTLCache(maxsize=10, ttl=30)
+
+    assert cache.setdefault("a", []) == []
+    cache.get("a").append(1)
+    assert cache.setdefault("a", []) == [1]
+    assert cache.pop("a") == [1]
+    assert cache.pop("a", "missing") == "missing"
+
+
+def test_ttl_cache_keeps_falsy_values(clock):
+    cache = main.TTLCache(maxsize=10, ttl=30)
+    cache[1] = False
+
+    assert 1 in cache
+    assert cache.get(1) is False
+
+
+def test_rate_limiter_spaces_calls(clock, monkeypatch):
+    sleeps = []
+
+    async def fake_sleep(delay):
+        sleeps.append(delay)
+
+    monkeypatch.setattr(main.asyncio, "sleep", fake_sleep)
+    limiter = main.RateLimiter(rate=4)
+
+    async def run():
+        for _ in range(3):
+            await limiter.wait()
+
+    asyncio.run(run())
+    assert sleeps == [0.25, 0.5]
+
+    clock[0] += 10
+    sleeps.clear()
+    asyncio.run(run())
+    assert sleeps == [0.25, 0.5]
+
+
+def test_chat_serial_middleware_orders_updates_per_chat():
+    log = []
+    active = {}
+
+    async def handler(event, data):
+        chat = data.get("event_chat")
+        if chat is None:
+            return event
+        active[chat.id] = active.get(chat.id, 0) + 1
+        assert active[chat.id] == 1
+        await asyncio.sleep(0.001 * (3 - event % 3))
+        log.append((chat.id, event))
+        active[chat.id] -= 1
+        return event
+
+    async def run():
+        middleware = main.ChatSerialMiddleware(global_limit=4)
+        return middleware, await asyncio.gather(
+            *(
+                middleware(handler, event, {"event_chat": SimpleNamespace(id=event % 3)})
+                for event in range(12)
+            ),
+            middleware(handler, 99, {}),
+        )
+
+    middleware, results = asyncio.run(run())
+    assert results == list(range(12)) + [99]
+    for chat_id in range(3):
+        events = [event for chat, event in log if chat == chat_id]
+        assert events == sorted(events)
+    assert not middleware._locks
+    assert not middleware._waiters